@@ -0,0 +1,22 @@
+"""
+benchmarks for tornado_smack, run them from the root of the repository::
+
+    python -m benchmarks                        # everything
+    python -m benchmarks handlers server        # some suites
+    python -m benchmarks --quick --json after.json
+    python -m benchmarks --compare before.json after.json
+
+every suite has a run(quick=False) function returning rows of
+dict(suite, name, params, metrics). request and call timings have per_sec,
+p50_us and p99_us metrics. --json writes them with the versions they were
+measured with, --compare shows the metrics of one file relative to another.
+"""
+
+# name -> module
+SUITES = (
+    ('handlers', 'benchmarks.handlers'),
+    ('server', 'benchmarks.server'),
+    ('dispatch', 'benchmarks.dispatch'),
+    ('json', 'benchmarks.json_encoding'),
+    ('startup', 'benchmarks.startup'),
+)
@@ -0,0 +1,40 @@
+import sys
+import argparse
+import importlib
+import logging
+from benchmarks import SUITES
+from benchmarks.common import print_results, save, compare
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('suites', nargs='*', help='one or more of: %s' % ', '.join(
+        name for name, module in SUITES))
+    parser.add_argument('--quick', action='store_true', help='fewer requests, for a smoke test')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two files written with --json')
+    options = parser.parse_args(argv)
+
+    if options.compare:
+        compare(*options.compare)
+        return
+    # tornado.access would log every request
+    logging.getLogger('tornado.access').setLevel(logging.WARNING)
+    modules = dict(SUITES)
+    names = options.suites or [name for name, module in SUITES]
+    for name in names:
+        if name not in modules:
+            parser.error('unknown suite %s' % name)
+    results = []
+    for name in names:
+        rows = importlib.import_module(modules[name]).run(quick=options.quick)
+        print_results(rows)
+        sys.stdout.flush()
+        results.extend(rows)
+    if options.json:
+        save(results, options.json)
+
+
+if __name__ == '__main__':
+    main()
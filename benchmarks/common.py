@@ -0,0 +1,215 @@
+"""
+helpers the benchmark suites share: running requests through an application
+in-process or through a real socket, and summarizing the timings.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import multiprocessing
+import tornado
+import tornado.ioloop
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient
+from tornado_smack.inprocess import Client
+from tornado_smack.metrics import timer
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(times, total):
+    """
+    rate, median and 99th percentile of a list of timings in seconds. total is the
+    wall clock time they took, which is more than their sum if they ran concurrently.
+    """
+    times = sorted(times)
+    return dict(per_sec=len(times) / total if total else 0.0,
+                p50_us=percentile(times, 0.5) * 1e6,
+                p99_us=percentile(times, 0.99) * 1e6)
+
+
+def time_calls(fn, number):
+    "calls fn number times, returns summarize() of them"
+    times = []
+    append = times.append
+    started = timer()
+    for i in range(number):
+        t = timer()
+        fn()
+        append(timer() - t)
+    return summarize(times, timer() - started)
+
+
+def result(suite, name, params, metrics):
+    return dict(suite=suite, name=name, params=params, metrics=metrics)
+
+
+@gen.coroutine
+def _drive(client, path, number, method):
+    times = []
+    started = timer()
+    for i in range(number):
+        t = timer()
+        future = client.fetch(method, path)
+        response = future.result() if future.done() else (yield future)
+        times.append(timer() - t)
+        if response.code != 200:
+            raise AssertionError('%s %s returned %s' % (method, path, response.code))
+    raise gen.Return(summarize(times, timer() - started))
+
+
+def run_sync(fn):
+    "runs fn on a fresh ioloop, which is closed afterwards"
+    io_loop = tornado.ioloop.IOLoop()
+    try:
+        return io_loop.run_sync(fn)
+    finally:
+        if tornado.version_info < (6,):
+            # it would stay the current one, even in the servers we fork later
+            tornado.ioloop.IOLoop.clear_current()
+        io_loop.close()
+
+
+def run_in_process(application, path, number, method='GET'):
+    """
+    sends number requests to application one after another, without sockets or
+    HTTP parsing, so only tornado's request handling and ours is measured
+    """
+    client = Client(application)
+    return run_sync(lambda: _drive(client, path, number, method))
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+@gen.coroutine
+def _fetch_all(url, number, concurrency):
+    client = AsyncHTTPClient(force_instance=True, max_clients=concurrency)
+    times = []
+    left = [number]
+
+    @gen.coroutine
+    def worker():
+        while left[0] > 0:
+            left[0] -= 1
+            t = timer()
+            yield client.fetch(url)
+            times.append(timer() - t)
+
+    started = timer()
+    try:
+        yield [worker() for i in range(concurrency)]
+    finally:
+        client.close()
+    raise gen.Return(summarize(times, timer() - started))
+
+
+def _serve(make_app, port, settings):
+    make_app().run(port=port, address='127.0.0.1', **settings)
+
+
+def run_server(make_app, path, number, concurrency=10, **settings):
+    """
+    starts make_app().run(**settings) in another process and fetches path from it
+    number times, concurrency requests at once
+    """
+    port = free_port()
+    process = multiprocessing.Process(target=_serve, args=(make_app, port, settings))
+    process.daemon = True
+    process.start()
+    try:
+        _wait_for_port(port)
+        url = 'http://127.0.0.1:%d%s' % (port, path)
+        return run_sync(lambda: _fetch_all(url, number, concurrency))
+    finally:
+        process.terminate()
+        process.join()
+
+
+def environment():
+    "what the results were measured with"
+    import werkzeug
+    return dict(python=platform.python_version(), implementation=platform.python_implementation(),
+                tornado=tornado.version, werkzeug=getattr(werkzeug, '__version__', None),
+                platform=sys.platform, cpus=multiprocessing.cpu_count(), time=time.time(),
+                revision=_git_revision())
+
+
+def _git_revision():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        with open(os.path.join(root, '.git', 'HEAD')) as f:
+            head = f.read().strip()
+        if head.startswith('ref: '):
+            with open(os.path.join(root, '.git', head[5:])) as f:
+                return f.read().strip()
+        return head
+    except (IOError, OSError):
+        return None
+
+
+def format_metrics(metrics):
+    return '  '.join('%s=%.1f' % (key, value) for key, value in sorted(metrics.items()))
+
+
+def format_params(params):
+    return ' '.join('%s=%s' % (key, value) for key, value in sorted(params.items()))
+
+
+def print_results(results, out=sys.stdout):
+    for row in results:
+        out.write('%-12s %-28s %-40s %s\n' % (row['suite'], row['name'], format_params(row['params']),
+                                             format_metrics(row['metrics'])))
+
+
+def save(results, path):
+    with open(path, 'w') as f:
+        json.dump(dict(environment=environment(), results=results), f, indent=2, sort_keys=True)
+
+
+def compare(old_path, new_path, out=sys.stdout):
+    """
+    prints how each metric of new_path changed since old_path, as new / old
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def key(row):
+        return row['suite'], row['name'], json.dumps(row['params'], sort_keys=True)
+    old_rows = dict((key(row), row) for row in old['results'])
+    for row in new['results']:
+        previous = old_rows.get(key(row))
+        if previous is None:
+            continue
+        changes = []
+        for metric, value in sorted(row['metrics'].items()):
+            before = previous['metrics'].get(metric)
+            if before:
+                changes.append('%s %.2fx' % (metric, value / before))
+        out.write('%-12s %-28s %-40s %s\n' % (row['suite'], row['name'], format_params(row['params']),
+                                             '  '.join(changes)))
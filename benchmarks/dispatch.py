@@ -0,0 +1,45 @@
+"""
+compares tornado's regexp scan with the trie dispatcher, for growing route tables.
+lookup time of the trie should stay flat from 10 to 5000 routes.
+"""
+import tornado.web
+from tornado.httputil import HTTPServerRequest
+from tornado_smack import App
+from benchmarks.common import time_calls, result
+
+SIZES = (10, 100, 1000, 5000)
+
+
+def make_app(size, dispatcher):
+    app = App(template_path='.', dispatcher=dispatcher)
+
+    def view(id):
+        return id
+
+    for i in range(size):
+        app.add_route('/resource%d/<int:id>/detail' % i, fn=view)
+    return app
+
+
+def make_application(app):
+    return app._make_application(tornado.web.Application)
+
+
+def bench(application, path, number):
+    request = HTTPServerRequest(method='GET', uri=path)
+    find_handler = application.find_handler
+    return time_calls(lambda: find_handler(request), number)
+
+
+def run(quick=False):
+    number = 200 if quick else 2000
+    rows = []
+    for size in SIZES:
+        for dispatcher in ('regex', 'trie'):
+            application = make_application(make_app(size, dispatcher))
+            for name, path in (('first', '/resource0/42/detail'),
+                               ('last', '/resource%d/42/detail' % (size - 1)),
+                               ('miss', '/nothing/here')):
+                rows.append(result('dispatch', name, dict(routes=size, dispatcher=dispatcher),
+                                   bench(application, path, number)))
+    return rows
@@ -0,0 +1,106 @@
+"""
+requests through generated handlers, in-process: route table size, wrapped and
+nowrap views, what views return and the template engines.
+"""
+import shutil
+import tempfile
+from tornado_smack import App, render_template
+from benchmarks.common import run_in_process, result
+
+ROUTE_TABLE_SIZES = (10, 100, 1000)
+
+TEMPLATES = {
+    'tornado': '<ul>{% for row in rows %}<li>{{ row }}</li>{% end %}</ul>',
+    'jinja2': '<ul>{% for row in rows %}<li>{{ row }}</li>{% endfor %}</ul>',
+}
+ROWS = list(range(50))
+
+
+def make_application(app):
+    return app.make_application(template_path=app.template_path)
+
+
+def routing(number):
+    rows = []
+    for size in ROUTE_TABLE_SIZES:
+        for dispatcher in ('regex', 'trie'):
+            app = App(template_path='.', dispatcher=dispatcher)
+
+            def view(id):
+                return id
+
+            for i in range(size):
+                app.add_route('/resource%d/<int:id>' % i, fn=view)
+            application = make_application(app)
+            rows.append(result('routing', 'last route', dict(routes=size, dispatcher=dispatcher),
+                               run_in_process(application, '/resource%d/1' % (size - 1), number)))
+    return rows
+
+
+def wrapping(number):
+    app = App(template_path='.')
+
+    @app.route('/wrapped/<id>')
+    def wrapped(id):
+        return id
+
+    @app.route('/nowrap/<id>', nowrap=True)
+    def nowrap(self, id):
+        self.write(id)
+
+    application = make_application(app)
+    return [result('wrapping', name, {}, run_in_process(application, '/%s/1' % name, number))
+            for name in ('wrapped', 'nowrap')]
+
+
+def returns(number):
+    template_path = tempfile.mkdtemp()
+    try:
+        with open('%s/page.html' % template_path, 'w') as f:
+            f.write(TEMPLATES['tornado'])
+        app = App(template_path=template_path)
+
+        @app.route('/string')
+        def string():
+            return 'hello world'
+
+        @app.route('/dict')
+        def as_dict():
+            return {'id': 1, 'name': 'hello world', 'rows': ROWS}
+
+        @app.route('/template')
+        def template():
+            return render_template('page.html', rows=ROWS)
+
+        application = make_application(app)
+        return [result('returns', name, {}, run_in_process(application, '/' + name, number))
+                for name in ('string', 'dict', 'template')]
+    finally:
+        shutil.rmtree(template_path)
+
+
+def engines(number):
+    rows = []
+    for engine in ('tornado', 'jinja2'):
+        template_path = tempfile.mkdtemp()
+        try:
+            with open('%s/page.html' % template_path, 'w') as f:
+                f.write(TEMPLATES[engine])
+            for mode in ('development', 'production'):
+                app = App(template_path=template_path, template_engine=engine, template_mode=mode)
+
+                @app.route('/template')
+                def template():
+                    return render_template('page.html', rows=ROWS)
+
+                application = app.make_application(template_path=template_path)
+                rows.append(result('engines', 'template', dict(engine=engine, mode=mode),
+                                   run_in_process(application, '/template', number)))
+        finally:
+            shutil.rmtree(template_path)
+    return rows
+
+
+def run(quick=False):
+    number = 200 if quick else 5000
+    return routing(number) + wrapping(number) + returns(number) + engines(number)
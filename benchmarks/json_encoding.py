@@ -0,0 +1,26 @@
+"""
+compares the json encoders we can use for view results, on a few payload shapes.
+install orjson and/or ujson to see them too.
+"""
+from tornado.escape import json_encode
+from tornado_smack.encoding import encoders
+from benchmarks.common import time_calls, result
+
+PAYLOADS = {
+    'small dict': {'id': 12345, 'name': 'smack', 'active': True, 'score': 4.5},
+    'list of 100 dicts': [{'id': i, 'name': 'item %d' % i, 'tags': ['a', 'b'], 'price': i * 1.5}
+                          for i in range(100)],
+    'nested': {'user': {'id': 1, 'profile': {'bio': 'x' * 200, 'links': ['http://a/'] * 10}},
+               'items': [{'id': i, 'children': [{'id': j} for j in range(10)]} for i in range(20)]},
+}
+
+
+def run(quick=False):
+    number = 200 if quick else 2000
+    rows = []
+    for payload_name, payload in sorted(PAYLOADS.items()):
+        for name in ['json_encode'] + sorted(encoders):
+            encoder = json_encode if name == 'json_encode' else encoders[name]
+            rows.append(result('json', payload_name, dict(encoder=name),
+                               time_calls(lambda: encoder(payload), number)))
+    return rows
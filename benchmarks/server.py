@@ -0,0 +1,32 @@
+"""
+requests through real sockets to App.run in another process, in debug and
+production mode.
+"""
+from tornado_smack import App
+from benchmarks.common import run_server, result
+
+CONCURRENCY = 10
+
+
+def make_app():
+    app = App(template_path='.')
+
+    @app.route('/string')
+    def string():
+        return 'hello world'
+
+    @app.route('/dict/<id>')
+    def as_dict(id):
+        return {'id': id, 'name': 'hello world'}
+
+    return app
+
+
+def run(quick=False):
+    number = 200 if quick else 5000
+    rows = []
+    for debug in (False, True):
+        for path in ('/string', '/dict/1'):
+            rows.append(result('server', path, dict(debug=debug, concurrency=CONCURRENCY),
+                               run_server(make_app, path, number, CONCURRENCY, debug=debug)))
+    return rows
@@ -0,0 +1,72 @@
+"""
+measures how long importing us and creating an App take, and how long it takes
+to register and compile a big route table. the second get_routes() call should
+cost next to nothing.
+"""
+import os
+import sys
+import subprocess
+from tornado_smack import App
+from tornado_smack.metrics import timer
+from benchmarks.common import result, time_calls, percentile
+
+SIZES = (1000, 5000)
+
+# tornado.web is imported first, so we only count what importing us adds to it
+IMPORT_CODE = """
+from time import time
+started = time()
+import tornado.web
+imported = time()
+import tornado_smack
+print('%r %r %d' % (imported - started, time() - imported, len(__import__('sys').modules)))
+"""
+
+
+def import_times(number):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root] + sys.path))
+    tornado_times, our_times, modules = [], [], 0
+    for i in range(number):
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_CODE], env=env)
+        tornado_time, our_time, modules = output.decode().split()
+        tornado_times.append(float(tornado_time))
+        our_times.append(float(our_time))
+    return dict(tornado_ms=percentile(sorted(tornado_times), 0.5) * 1000,
+                import_ms=percentile(sorted(our_times), 0.5) * 1000, modules=int(modules))
+
+
+def view(id):
+    return id
+
+
+def self_view(self, id):
+    self.write(id)
+
+
+def run(quick=False):
+    rows = [result('startup', 'import', {}, import_times(5 if quick else 30))]
+    number = 200 if quick else 2000
+    # without a template_path we look for the templates of our caller
+    rows.append(result('startup', 'App()', dict(template_path=None),
+                       time_calls(App, number)))
+    rows.append(result('startup', 'App()', dict(template_path='.'),
+                       time_calls(lambda: App(template_path='.'), number)))
+    for size in SIZES[:1] if quick else SIZES:
+        app = App(template_path='.')
+        start = timer()
+        for i in range(size):
+            app.add_route('/resource%d/<int:id>' % i, fn=view if i % 2 else self_view,
+                          methods=['GET', 'POST', 'PUT', 'DELETE'])
+        added = timer()
+        app.get_routes()
+        compiled = timer()
+        app.get_routes()
+        cached = timer()
+        app.add_route('/one/more/<int:id>', fn=view)
+        app.get_routes()
+        one_more = timer()
+        rows.append(result('startup', 'route table', dict(routes=size), dict(
+            add_ms=(added - start) * 1000, compile_ms=(compiled - added) * 1000,
+            cached_ms=(cached - compiled) * 1000, one_more_ms=(one_more - cached) * 1000)))
+    return rows
@@ -1,4 +1,4 @@
-from tornado_smack import App
+from tornado_smack import App, render_template
 from tornado_smack.app import handler
 import unittest
 import re
@@ -8,14 +8,16 @@ from multiprocessing import Process
 from tornado.gen import coroutine
 from tornado.httpclient import AsyncHTTPClient
 import json
+import sys
+import tornado.web
+from tornado import gen
+from tornado import testing
+from tornado.testing import gen_test
 
 import logging
 logging.basicConfig(level=logging.DEBUG)
 
 
-req_cnt = 0
-statuses = {}
-
 def wait_until(fn, timeout=15):
     t = timeout
     while True:
@@ -28,6 +30,12 @@ def wait_until(fn, timeout=15):
             raise Exception('timeout waiting function')
 
 
+# views that run in another process have to be picklable
+def process_view(n):
+    import os
+    return {'pid': os.getpid(), 'sum': sum(range(int(n)))}
+
+
 class TestRouting(unittest.TestCase):
 
     def test_route(self):
@@ -36,131 +44,1448 @@ class TestRouting(unittest.TestCase):
         assert app.is_werkzeug_route(r'/foo/<int:year>')
         assert app.is_werkzeug_route(r'/foo/<year>')
 
-    def test_proxy_method(self):
-        """
-        we create two servers, and we'll make them sleep with different times.
-        then we create our app, which makes a request to those sleeping servers,
-        then we send multiple requests to our app, and see if everything went well
-        """
-        app2 = App()
-
-        @app2.route("/wait/<t>/<id>")
-        def wait(self, t, id):
-            import time
-            time.sleep(int(t))
-            self.write({"waited": t, "id": id})
-
-        p1 = Process(target=app2.run, kwargs={'port': 8889, 'debug':True})
-        p1.start()
-
-        p2 = Process(target=app2.run, kwargs={'port': 8890, 'debug':True})
-        p2.start()
-
-        # now we create a server for ourselves...
+    def test_add_route(self):
+
+        app = App()
+
+        @app.route("/foo")
+        def foo2(self):
+            self.write('foo2')
+
+        @app.route("/foo/<slug>")
+        def foo(self, slug):
+            self.write(slug)
+
+        @app.route("/get/<int:id>/<int:w>")
+        def get(self, id, w):
+            self.write(id)
+
+        @app.route("/post/<id>", methods=['POST'])
+        def postmethod(self, id):
+            self.write(id)
+
+        client = app.test_client(debug=True)
+        assert client.get('/foo/bar').body == b'bar'
+        assert client.get('/foo').body == b'foo2'
+        assert client.get('/get/1/2').body == b'1'
+        assert client.get('/post/1').code == 405
+        assert client.post('/post/1', {'c': 1}).body == b'1'
+        client.close()
+
+    def test_client(self):
         app = App()
 
-        @app.route("/statuses")
-        def get_statuses(self):
-            self.write(statuses)
+        @app.route("/echo/<int:id>", methods=['GET', 'POST'])
+        def echo(id):
+            return {'id': id, 'c': handler.get_argument('c', None),
+                    'lang': handler.request.headers.get('Accept-Language'),
+                    'ip': handler.request.remote_ip}
+
+        @app.route("/later")
+        @coroutine
+        def later(self_):
+            yield gen.sleep(0.01)
+            self_.write('later')
 
-        @app.route("/somejson", nowrap=True)
+        client = app.test_client()
+        response = client.get('/echo/1?c=2', headers={'Accept-Language': 'tr'})
+        assert response.code == 200
+        assert response.headers['Content-Type'] == 'application/json; charset=UTF-8'
+        assert response.json() == {'id': '1', 'c': '2', 'lang': 'tr', 'ip': '127.0.0.1'}
+        assert client.post('/echo/1', {'c': 3}).json()['c'] == '3'
+        assert client.get('/later').body == b'later'
+        assert client.get('/nothing').code == 404
+        assert client.delete('/echo/1').code == 405
+        client.close()
+
+
+class TestProxy(testing.AsyncHTTPTestCase):
+    """
+    our view starts a request to a slow or a fast backend and doesn't wait for it, the
+    first ones finish last. each one has to see its own handler when it is done.
+    """
+
+    def get_app(self):
+        self.app = App()
+        self.app.debug = False
+        self.statuses = statuses = {}
+        get_url = self.get_url
+
+        @self.app.route("/wait/<t>/<id>")
+        @coroutine
+        def wait(self_, t, id):
+            yield gen.sleep(float(t))
+            self_.write({"waited": t, "id": id})
+
+        @self.app.route("/somejson", nowrap=True)
         def somejson():
-            global req_cnt, statuses
-            req_cnt += 1
-            handler.req_cnt = req_cnt
+            handler.req_cnt = req_cnt = len(statuses) + 1
             statuses[req_cnt] = None
             @coroutine
             def w():
-                http_client = AsyncHTTPClient()
-                if req_cnt % 2 == 0:
-                    response = yield http_client.fetch("http://localhost:8889/wait/%s/%s" % (5, req_cnt))
-                else:
-                    response = yield http_client.fetch("http://localhost:8890/wait/%s/%s" % (1, req_cnt))
-                # we wait until the request complete, though at the same time we make more requests,
-                # the first req. completes later than the second. we'll see if we can keep the context
+                t = 0.2 if req_cnt % 2 == 0 else 0.05
+                response = yield AsyncHTTPClient().fetch(get_url('/wait/%s/%s' % (t, req_cnt)))
                 resp_result = json.loads(response.body)
-                status = resp_result['id'] == str(handler.req_cnt)
-                statuses[handler.req_cnt] = status
+                statuses[handler.req_cnt] = resp_result['id'] == str(handler.req_cnt)
             w()
             return {'req': handler.req_cnt}
 
+        return self.app._make_application(tornado.web.Application)
+
+    @gen_test
+    def test_proxy_method(self):
+        for i in range(1, 5):
+            response = yield self.http_client.fetch(self.get_url('/somejson'))
+            assert json.loads(response.body) == {'req': i}
+        while None in self.statuses.values():
+            yield gen.sleep(0.01)
+        assert self.statuses == {1: True, 2: True, 3: True, 4: True}
 
-        p3 = Process(target=app.run, kwargs={'debug':True})
-        p3.start()
-        time.sleep(3)
 
+class TestProcesses(unittest.TestCase):
+
+    def test_workers_restart_and_stop(self):
+        import os
+        import signal
+        app = App()
+
+        @app.route("/pid")
+        def pid():
+            return str(os.getpid())
+
+        p = Process(target=app.run, kwargs={'port': 8891, 'processes': 2})
+        p.start()
         try:
-            waiting_statuses = []
-            for i in range(1,5):
-                r1 = requests.get('http://localhost:8888/somejson')
+            def get_pid():
                 try:
-                    result = json.loads(r1.content)
-                except:
-                    print(r1.content)
-                    raise
-                waiting_statuses.append(result)
-
-            def wait_all_complete():
-                r2 = requests.get('http://localhost:8888/statuses')
-                print("------")
-                print(r2.content)
-                print("------")
-                results = json.loads(r2.content)
-                print(results)
-                if len(results) == 4:
-                    all_true = True
-                    for i in range(1,5):
-                        if results[str(i)] != True:
-                            all_true = False
-                    if all_true:
-                        return all_true
-
-            wait_until(wait_all_complete, 50)
+                    return int(requests.get('http://localhost:8891/pid').content)
+                except requests.ConnectionError:
+                    return None
 
+            wait_until(get_pid)
+            worker = get_pid()
+            assert worker != p.pid
+            os.kill(worker, signal.SIGKILL)
+            wait_until(lambda: get_pid() not in (None, worker))
         finally:
-            p1.terminate()
-            p2.terminate()
-            p3.terminate()
+            p.terminate()
+            p.join(10)
+        assert p.exitcode == 0
+        self.assertRaises(OSError, os.kill, worker, 0)
+        assert get_pid() is None
 
 
-    def test_add_route(self):
+RELOADED_APP = '''
+import os
+import sys
+from tornado import gen
+from tornado.gen import coroutine
+from tornado_smack import App
 
-        app = App()
+app = App(template_path='.')
 
-        @app.route("/foo")
-        def foo2(self):
-            self.write('foo2')
+@app.route("/pid")
+def pid():
+    return str(os.getpid())
 
-        @app.route("/foo/<slug>")
-        def foo(self, slug):
-            self.write(slug)
+@app.route("/sleep/<t>")
+@coroutine
+def sleep(self_, t):
+    yield gen.sleep(float(t))
+    self_.write(t)
 
-        @app.route("/get/<int:id>/<int:w>")
-        def get(self, id, w):
-            self.write(id)
+@app.route("/ppid")
+def ppid():
+    return str(os.getppid())
 
-        @app.route("/post/<id>", methods=['POST'])
-        def postmethod(self, id):
-            self.write(id)
+processes = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+app.run(port=int(sys.argv[1]), processes=processes, reuse_port=processes > 1, reload=True)
+'''
+
+
+class TestShutdown(unittest.TestCase):
+
+    def get_pid(self, port):
+        try:
+            return int(requests.get('http://localhost:%d/pid' % port).content)
+        except requests.ConnectionError:
+            return None
+
+    def test_graceful_stop(self):
+        import os
+        import signal
+        import threading
+        app = App()
+
+        @app.route("/pid")
+        def pid():
+            return str(os.getpid())
 
-        from multiprocessing import Process
-        p = Process(target=app.run, kwargs={'debug':True})
+        @app.route("/sleep/<t>")
+        @coroutine
+        def sleep(self, t):
+            yield gen.sleep(float(t))
+            self.write(t)
+
+        p = Process(target=app.run, kwargs={'port': 8892, 'drain_timeout': 5})
         p.start()
-        time.sleep(1)
         try:
-            r = requests.get('http://localhost:8888/foo/bar')
-            assert r.content == 'bar'
-            r = requests.get('http://localhost:8888/foo')
-            assert r.content == 'foo2'
-            r = requests.get('http://localhost:8888/get/1/2')
-            assert r.content == '1'
-
-            r = requests.get('http://localhost:8888/post/1')
-            assert r.status_code == 405
-            r = requests.post('http://localhost:8888/post/1', {'c':1})
-            assert r.content == '1'
+            wait_until(lambda: self.get_pid(8892))
+            responses = []
+            slow = threading.Thread(target=lambda: responses.append(
+                requests.get('http://localhost:8892/sleep/0.5')))
+            slow.start()
+            time.sleep(0.2)
+            os.kill(p.pid, signal.SIGTERM)
+            slow.join()
+            # the request in flight is served, then we stop
+            assert responses[0].status_code == 200 and responses[0].content == b'0.5'
+            p.join(5)
+            assert p.exitcode == 0
+            assert self.get_pid(8892) is None
         finally:
             p.terminate()
+            p.join()
+
+    def test_reload(self):
+        import os
+        import signal
+        import tempfile
+        import subprocess
+        script = tempfile.NamedTemporaryFile('w', suffix='.py', delete=False)
+        script.write(RELOADED_APP)
+        script.close()
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        old = subprocess.Popen([sys.executable, script.name, '8893'], env=env)
+        new = None
+        try:
+            wait_until(lambda: self.get_pid(8893))
+            assert self.get_pid(8893) == old.pid
+            os.kill(old.pid, signal.SIGHUP)
+            pids = set()
+            # no request fails while the new process takes over
+            while len(pids) < 2:
+                pids.add(self.get_pid(8893))
+                assert None not in pids
+            new = self.get_pid(8893)
+            assert new != old.pid
+            assert old.wait() == 0
+            assert self.get_pid(8893) == new
+        finally:
+            if old.poll() is None:
+                old.kill()
+            if new is not None:
+                os.kill(new, signal.SIGTERM)
+                wait_until(lambda: self.get_pid(8893) is None)
+            os.unlink(script.name)
+
+    def test_reload_workers(self):
+        import os
+        import signal
+        import tempfile
+        import subprocess
+        script = tempfile.NamedTemporaryFile('w', suffix='.py', delete=False)
+        script.write(RELOADED_APP)
+        script.close()
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        old = subprocess.Popen([sys.executable, script.name, '8894', '2'], env=env)
+        new = None
+        try:
+            wait_until(lambda: self.get_pid(8894))
+            old_workers = set(self.get_pid(8894) for i in range(20))
+            os.kill(old.pid, signal.SIGHUP)
+            deadline = time.time() + 30
+            # the new workers bind their own sockets, the old ones stop once they all did
+            while old.poll() is None and time.time() < deadline:
+                assert self.get_pid(8894) is not None
+            assert old.wait() == 0
+            assert self.get_pid(8894) not in old_workers
+            new = int(requests.get('http://localhost:8894/ppid').content)
+        finally:
+            if old.poll() is None:
+                old.kill()
+            if new is not None:
+                os.kill(new, signal.SIGTERM)
+                wait_until(lambda: self.get_pid(8894) is None)
+            os.unlink(script.name)
+
+    def test_stop_process_group(self):
+        import os
+        import signal
+        import tempfile
+        import threading
+        import subprocess
+        script = tempfile.NamedTemporaryFile('w', suffix='.py', delete=False)
+        script.write(RELOADED_APP)
+        script.close()
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        # like ctrl+c in a terminal, or systemd, signalling the supervisor and the workers
+        server = subprocess.Popen([sys.executable, script.name, '8895', '2'], env=env,
+                                  preexec_fn=os.setsid)
+        try:
+            wait_until(lambda: self.get_pid(8895))
+            workers = set(self.get_pid(8895) for i in range(50))
+            assert len(workers) == 2
+            responses = []
+            slow = threading.Thread(target=lambda: responses.append(
+                requests.get('http://localhost:8895/sleep/0.5')))
+            slow.start()
+            time.sleep(0.2)
+            os.killpg(server.pid, signal.SIGTERM)
+            # what the supervisor passes on, when the workers handled the first one already
+            time.sleep(0.05)
+            for worker in workers:
+                try:
+                    os.kill(worker, signal.SIGTERM)
+                except OSError:
+                    # it had nothing to wait for
+                    pass
+            slow.join()
+            # the workers drain, the supervisor passing the signal on doesn't cut it short
+            assert responses[0].status_code == 200 and responses[0].content == b'0.5'
+            assert server.wait() == 0
+        finally:
+            if server.poll() is None:
+                os.killpg(server.pid, signal.SIGKILL)
+            os.unlink(script.name)
+
+
+class TestDebugStore(unittest.TestCase):
+
+    def test_lru(self):
+        from tornado_smack.lru import LRUDict
+        d = LRUDict(max_entries=3, max_bytes=10, sizeof=len)
+        d['a'] = 'aa'
+        d['b'] = 'bb'
+        d['c'] = 'cc'
+        d['a']
+        d['d'] = 'dd'
+        assert list(d) == ['c', 'a', 'd']
+        d['e'] = 'eeeeeeee'
+        assert list(d) == ['d', 'e']
+        assert d.stats() == dict(entries=2, bytes=10, evictions=3, evicted_bytes=6)
+
+    def test_tracebacks_are_bounded(self):
+        from werkzeug.debug import DebuggedApplication
+        from tornado_smack.app import DebugApplication
+        application = DebugApplication([], debug_max_tracebacks=3, debug_max_frames=5)
+        application.set_debug_app(DebuggedApplication(app=None, evalex=True))
+
+        def fail(i):
+            raise Exception(i)
+
+        for i in range(10):
+            try:
+                fail(i)
+            except Exception:
+                traceback = application.get_current_traceback()
+        stats = application.debug_stats()
+        assert stats['tracebacks']['entries'] == 3
+        assert stats['tracebacks']['evictions'] == 7
+        assert stats['frames']['entries'] <= 5
+        assert application.debug_app.tracebacks.peek(traceback.id) is traceback
+
+
+class TestTemplates(unittest.TestCase):
+
+    def setUp(self):
+        import os
+        import tempfile
+        self.template_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.template_path, 'sub'))
+        os.mkdir(os.path.join(self.template_path, '.hidden'))
+        for name in ['page.html', 'sub/part.html', '.hidden/x.html']:
+            with open(os.path.join(self.template_path, name), 'w') as f:
+                f.write('hello {{ name }}')
+
+    def change_template(self):
+        import os
+        with open(os.path.join(self.template_path, 'page.html'), 'w') as f:
+            f.write('changed')
+
+    def test_jinja2_production(self):
+        import os
+        import tempfile
+        cache_path = tempfile.mkdtemp()
+        app = App(template_path=self.template_path, template_engine='jinja2',
+                  template_mode='production', template_cache_path=cache_path)
+        assert app.list_templates() == ['page.html', 'sub/part.html']
+        app.precompile_templates()
+        assert len(os.listdir(cache_path)) == 2
+        self.change_template()
+        assert app.template_env.get_template('page.html').render(name='x') == 'hello x'
+
+    def test_tornado_production(self):
+        app = App(template_path=self.template_path, template_mode='production')
+        loader = app.precompile_templates()
+        assert sorted(loader.templates) == ['page.html', 'sub/part.html']
+        self.change_template()
+        assert loader.load('page.html').generate(name='x') == b'hello x'
+
+
+class TestStreamingTemplate(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        import os
+        import tempfile
+        from tornado_smack import render_template
+        template_path = tempfile.mkdtemp()
+        with open(os.path.join(template_path, 'rows.html'), 'w') as f:
+            f.write('{% for row in rows %}<p>{{ row }}</p>{% endfor %}')
+
+        app = App(template_path=template_path, template_engine='jinja2', stream_chunk_size=100)
+        app.debug = False
+
+        @app.route("/rows/<int:count>")
+        def rows(count):
+            return render_template('rows.html', rows=range(int(count)), stream=True)
+
+        return app._make_application(tornado.web.Application)
+
+    def test_stream(self):
+        chunks = []
+        response = self.fetch('/rows/1000', streaming_callback=chunks.append)
+        assert response.code == 200
+        assert len(chunks) > 10
+        assert b''.join(chunks) == b''.join(b'<p>%d</p>' % i for i in range(1000))
+
+
+class TestStreamingView(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.app = App(stream_chunk_size=100)
+        self.app.debug = False
+        self.closed = closed = []
+
+        @self.app.route("/csv/<int:count>")
+        def csv(count):
+            handler.set_header('Content-Type', 'text/csv')
+            try:
+                for i in range(int(count)):
+                    # we are still the current handler between chunks
+                    yield '%d,%s\n' % (i, handler.request.path)
+            finally:
+                closed.append(count)
+
+        @self.app.route("/broken/<int:count>")
+        def broken(count):
+            for i in range(int(count)):
+                yield '%d,%s\n' % (i, 'x' * 50)
+            raise ValueError('the database went away')
+
+        if sys.version_info >= (3, 6):
+            # python 2 can't parse async generators
+            namespace = {'handler': handler, 'gen': gen, 'closed': closed}
+            exec('''async def lines(count):
+    for i in range(int(count)):
+        await gen.sleep(0.001)
+        yield b'%d %s\\n' % (i, handler.request.path.encode())
+
+async def forever():
+    try:
+        i = 0
+        while True:
+            await gen.sleep(0.001)
+            yield b'%d %s\\n' % (i, handler.request.path.encode())
+            i += 1
+    finally:
+        closed.append(handler.request.path)''', namespace)
+            self.app.add_route("/lines/<int:count>", fn=namespace['lines'])
+            self.app.add_route("/forever", fn=namespace['forever'])
+
+        return self.app._make_application(tornado.web.Application)
+
+    def test_generator(self):
+        chunks = []
+        response = self.fetch('/csv/100', streaming_callback=chunks.append)
+        assert response.code == 200
+        assert response.headers['Content-Type'] == 'text/csv'
+        assert len(chunks) > 10
+        assert b''.join(chunks) == ''.join('%d,/csv/100\n' % i for i in range(100)).encode()
+        assert self.closed == ['100']
+        assert self.app.metrics.route('/csv/<int:count>').histograms['serialization'].count == 1
+
+    @unittest.skipIf(sys.version_info < (3, 6), 'needs async generators')
+    def test_async_generator(self):
+        chunks = []
+        response = self.fetch('/lines/20', streaming_callback=chunks.append)
+        assert response.code == 200
+        # each one is sent as soon as it is made
+        assert len(chunks) > 5
+        assert b''.join(chunks) == b''.join(b'%d /lines/20\n' % i for i in range(20))
+
+    def test_error_while_streaming(self):
+        chunks = []
+        try:
+            response = self.fetch('/broken/5', streaming_callback=chunks.append)
+            code = response.code
+        except tornado.httpclient.HTTPError as e:
+            code = e.code
+        # the rows we sent can't be taken back, but the response must not look whole
+        assert code == 599
+        assert b''.join(chunks).startswith(b'0,')
+
+    @unittest.skipIf(sys.version_info < (3, 6), 'needs async generators')
+    @gen_test
+    def test_client_disconnects(self):
+        import socket
+        from tornado.iostream import IOStream
+        stream = IOStream(socket.socket())
+        yield stream.connect(('127.0.0.1', self.get_http_port()))
+        yield stream.write(b'GET /forever HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        yield stream.read_until(b'3 /forever\n')
+        stream.close()
+        for i in range(100):
+            if self.closed:
+                break
+            yield gen.sleep(0.01)
+        # closed right away, as the current handler
+        assert self.closed == ['/forever']
+
+
+class TestCache(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        from tornado_smack import CachePolicy
+        app = App()
+        app.debug = False
+        self.calls = calls = []
+        self.policy = CachePolicy(ttl=60, max_entries=10, vary=['page'])
+
+        @app.route("/articles/<category>", cache=self.policy)
+        def articles(category):
+            calls.append(category)
+            handler.set_header('X-Page', handler.get_argument('page', '1'))
+            return {'category': category, 'calls': len(calls)}
+
+        @app.route("/cookie", cache=self.policy)
+        def cookie():
+            calls.append('cookie')
+            handler.set_cookie('a', 'b')
+            return 'cookie'
+
+        @app.route("/items/<int:id>", cache=self.policy)
+        def item(id):
+            calls.append(id)
+            return 'item %s' % id
+
+        return app._make_application(tornado.web.Application)
+
+    def test_cache(self):
+        first = self.fetch('/articles/news?page=1')
+        again = self.fetch('/articles/news?page=1&utm=x')
+        assert again.body == first.body
+        assert again.headers['X-Page'] == '1'
+        assert again.headers['Content-Type'] == first.headers['Content-Type']
+        self.fetch('/articles/news?page=2')
+        self.fetch('/articles/sports?page=1')
+        assert self.calls == ['news', 'news', 'sports']
+
+        self.policy.invalidate(category='news')
+        self.fetch('/articles/news?page=1')
+        self.fetch('/articles/sports?page=1')
+        assert self.calls == ['news', 'news', 'sports', 'news']
+
+        self.fetch('/cookie')
+        self.fetch('/cookie')
+        assert self.calls.count('cookie') == 2
+        assert self.policy.stats() == dict(hits=2, misses=6, expired=0, evictions=0, entries=2)
+
+    def test_invalidate_numbers(self):
+        self.fetch('/items/42')
+        self.policy.invalidate(id=42)
+        self.fetch('/items/42')
+        assert self.calls == ['42', '42']
+
+    def test_not_modified(self):
+        etag = self.fetch('/items/1').headers['Etag']
+        response = self.fetch('/items/1', headers={'If-None-Match': etag})
+        assert response.code == 304 and response.body == b''
+        response = self.fetch('/items/1', headers={'If-None-Match': '"other"'})
+        assert response.code == 200 and response.body == b'item 1'
+        assert self.calls == ['1']
+
+
+class TestJson(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        app = App(json_encoder=lambda value: json.dumps(value, sort_keys=True, default=vars))
+        app.debug = False
+
+        @app.route("/dict")
+        def as_dict():
+            return {'b': '</script>', 'a': 1}
+
+        @app.route("/list")
+        def as_list():
+            return [1, 2, 3]
+
+        if sys.version_info >= (3, 7):
+            import dataclasses
+            Point = dataclasses.make_dataclass('Point', ['x', 'y'])
+
+            @app.route("/dataclass")
+            def as_dataclass():
+                return Point(1, [Point(2, 3)])
+
+        return app._make_application(tornado.web.Application)
+
+    def test_custom_encoder(self):
+        response = self.fetch('/dict')
+        assert response.body == b'{"a": 1, "b": "</script>"}'
+        assert response.headers['Content-Type'] == 'application/json; charset=UTF-8'
+        assert json.loads(self.fetch('/list').body) == [1, 2, 3]
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'needs dataclasses')
+    def test_encoders(self):
+        import dataclasses
+        from tornado_smack.encoding import encoders
+        Point = dataclasses.make_dataclass('Point', ['x', 'y'])
+        value = {'point': Point(1, [Point(2, 3)]), 'html': '</script>', 1: None}
+        for name, encoder in encoders.items():
+            encoded = encoder(value)
+            assert b'</' not in (encoded if isinstance(encoded, bytes) else encoded.encode('utf-8')), name
+            assert json.loads(encoded) == {'point': {'x': 1, 'y': [{'x': 2, 'y': 3}]},
+                                           'html': '</script>', '1': None}, name
+        assert json.loads(self.fetch('/dataclass').body) == {'x': 1, 'y': [{'x': 2, 'y': 3}]}
+
+
+class TestExecutor(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        app = App(thread_pool_size=4)
+        app.debug = False
+
+        @app.route("/sleep/<t>", executor='thread')
+        def slow(t):
+            time.sleep(float(t))
+            return {'path': handler.request.path}
+
+        @app.route("/fast")
+        def fast():
+            return 'fast'
+
+        return app._make_application(tornado.web.Application)
+
+    @gen_test
+    def test_thread(self):
+        finished = []
+
+        @coroutine
+        def fetch(path):
+            response = yield self.http_client.fetch(self.get_url(path))
+            finished.append(path)
+            raise gen.Return(response)
+
+        responses = yield [fetch('/sleep/0.5'), fetch('/sleep/0.4'), fetch('/fast')]
+        assert finished[0] == '/fast'
+        assert json.loads(responses[0].body) == {'path': '/sleep/0.5'}
+        assert json.loads(responses[1].body) == {'path': '/sleep/0.4'}
+
+
+class TestProcessExecutor(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.app = App(process_pool_size=2)
+        self.app.debug = False
+        self.app.route("/sum/<n>", executor='process')(process_view)
+        return self.app._make_application(tornado.web.Application)
+
+    def tearDown(self):
+        super(TestProcessExecutor, self).tearDown()
+        self.app.process_executor.shutdown()
+
+    def test_process(self):
+        import os
+        response = self.fetch('/sum/100')
+        result = json.loads(response.body)
+        assert result['sum'] == 4950
+        assert result['pid'] != os.getpid()
+        assert response.headers['Content-Type'].startswith('application/json')
+
+    def test_pool_is_reused(self):
+        pool = self.app.get_executor('process')
+        assert self.app.get_executor('process') is pool
+        # as if we had forked
+        self.app._process_executor_pid = -1
+        assert self.app.get_executor('process') is not pool
+        pool.shutdown()
+
+
+class TestMetrics(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.app = App(metrics_url='/metrics')
+        self.app.debug = False
+
+        @self.app.route("/items/<id>")
+        def item(id):
+            if id == 'missing':
+                raise tornado.web.HTTPError(404)
+            return {'id': id}
+
+        return self.app._make_application(tornado.web.Application)
+
+    def test_metrics(self):
+        for path in ('/items/1', '/items/2', '/items/missing'):
+            self.fetch(path)
+        metrics = self.app.metrics.route('/items/<id>')
+        assert metrics.requests == 3
+        assert metrics.statuses == {200: 2, 404: 1}
+        assert metrics.histograms['request'].count == 3
+        assert metrics.histograms['view'].count == 3
+        assert metrics.histograms['serialization'].count == 2
+        assert metrics.histograms['template'].count == 0
+
+        response = self.fetch('/metrics')
+        assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+        body = response.body.decode('utf-8')
+        assert 'smack_requests_total{route="/items/<id>",status="200"} 2' in body
+        assert 'smack_request_duration_seconds_bucket{route="/items/<id>",phase="view",le="+Inf"} 3' in body
+        assert 'smack_request_duration_seconds_count{route="/items/<id>",phase="serialization"} 2' in body
+
+
+class TestProfiling(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        import tempfile
+        self.profile_dir = tempfile.mkdtemp()
+        self.app = App(profile_secret='secret', profile_dir=self.profile_dir)
+        self.app.debug = False
+
+        @self.app.route("/items/<id>")
+        def item(id):
+            return {'id': id}
+
+        return self.app._make_application(tornado.web.Application)
+
+    def test_not_profiled(self):
+        response = self.fetch('/items/1', headers={'X-Smack-Profile': 'bad token'})
+        assert json.loads(response.body) == {'id': '1'}
+        assert 'X-Smack-Profile-Time' not in response.headers
+        # a token for another path
+        token = self.app.profiler.token('/items/2')
+        response = self.fetch('/items/1?_profile=' + token)
+        assert 'X-Smack-Profile-Time' not in response.headers
+
+    def test_expired_token(self):
+        token = self.app.profiler.token('/items/1', ttl=-1)
+        response = self.fetch('/items/1', headers={'X-Smack-Profile': token})
+        assert json.loads(response.body) == {'id': '1'}
+        assert 'X-Smack-Profile-Time' not in response.headers
+        # the expiry time is signed too
+        expires, signature = token.split('.')
+        token = '%d.%s' % (int(expires) + 3600, signature)
+        response = self.fetch('/items/1', headers={'X-Smack-Profile': token})
+        assert 'X-Smack-Profile-Time' not in response.headers
+
+    def test_header(self):
+        token = self.app.profiler.token('/items/1')
+        response = self.fetch('/items/1', headers={'X-Smack-Profile': token})
+        assert json.loads(response.body) == {'id': '1'}
+        assert float(response.headers['X-Smack-Profile-Time']) >= 0
+        assert any('_run_view' in stat for stat in response.headers.get_list('X-Smack-Profile-Stat'))
+
+    def test_file(self):
+        import os
+        import pstats
+        token = self.app.profiler.token('/items/1')
+        response = self.fetch('/items/1', headers={'X-Smack-Profile': token,
+                                                   'X-Smack-Profile-Output': 'file'})
+        assert json.loads(response.body) == {'id': '1'}
+        path = response.headers['X-Smack-Profile-File']
+        assert os.path.dirname(path) == self.profile_dir
+        assert os.path.basename(path).startswith('items_id')
+        assert pstats.Stats(path).total_calls > 0
+
+    def test_html(self):
+        token = self.app.profiler.token('/items/1')
+        response = self.fetch('/items/1?_profile=%s&_profile_output=html' % token)
+        assert response.headers['Content-Type'] == 'text/html; charset=UTF-8'
+        assert b'GET /items/1' in response.body
+        assert b'cumtime' in response.body
+
+
+class TestUrlFor(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        import tempfile
+        template_path = tempfile.mkdtemp()
+        with open(template_path + '/links.html', 'w') as f:
+            f.write("{{ url_for('article', id=1, slug='a b') }}")
+        self.app = App(template_path=template_path)
+        self.app.debug = False
+
+        @self.app.route("/articles/<int:id>/<slug>")
+        def article(id, slug):
+            return slug
+
+        @self.app.route("/links")
+        def links():
+            return render_template('links.html')
+
+        return self.app._make_application(tornado.web.Application, template_path=template_path)
+
+    def test_url_for(self):
+        from werkzeug.routing import BuildError
+        app = self.app
+        assert app.url_for('article', id=42, slug='foo') == '/articles/42/foo'
+        assert app.url_for('article', id=42, slug='foo', page=2) == '/articles/42/foo?page=2'
+        assert app.url_for('links') == '/links'
+        self.assertRaises(BuildError, lambda: app.url_for('article', id=42))
+        self.assertRaises(BuildError, lambda: app.url_for('nothing'))
+        assert len(app._url_cache) == 3
+        assert app.url_for('article', id=42, slug='foo') == '/articles/42/foo'
+        assert len(app._url_cache) == 3
+        # unhashable values aren't remembered
+        assert app.url_for('links', ids=[1, 2]) == '/links?ids=1&ids=2'
+        assert len(app._url_cache) == 3
+
+    def test_template(self):
+        assert self.fetch('/links').body == b'/articles/1/a%20b'
+
+    def test_jinja2(self):
+        app = App(template_path='.', template_engine='jinja2')
+
+        @app.route("/articles/<int:id>")
+        def article(id):
+            return id
+
+        template = app.template_env.from_string("{{ url_for('article', id=7) }}")
+        assert template.render() == '/articles/7'
+
+
+class TestStatic(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        import gzip
+        import tempfile
+        self.static_path = tempfile.mkdtemp()
+        self.css = b'body { color: red }' * 10
+        self.big = b'x' * 5000
+        with open(self.static_path + '/app.css', 'wb') as f:
+            f.write(self.css)
+        with open(self.static_path + '/app.css.br', 'wb') as f:
+            f.write(b'pretend this is brotli')
+        f = gzip.open(self.static_path + '/app.css.gz', 'wb')
+        f.write(self.css)
+        f.close()
+        with open(self.static_path + '/big.bin', 'wb') as f:
+            f.write(self.big)
+        self.app = App(static_path=self.static_path, static_cache_file_size=1024)
+        self.app.debug = False
+        return self.app._make_application(tornado.web.Application)
+
+    def fetch_static(self, path, **headers):
+        return self.fetch(path, headers=headers, decompress_response=False)
+
+    def test_files(self):
+        response = self.fetch_static('/static/app.css')
+        assert response.body == self.css
+        assert response.headers['Content-Type'] == 'text/css'
+        assert response.headers['Vary'] == 'Accept-Encoding'
+        assert 'Content-Encoding' not in response.headers
+        assert self.fetch_static('/static/big.bin').body == self.big
+        cache = self.app.get_static_handler_class().memory_cache
+        assert self.static_path + '/app.css' in cache
+        assert self.static_path + '/big.bin' not in cache
+
+    def test_precompressed(self):
+        import gzip
+        import io
+        response = self.fetch_static('/static/app.css', **{'Accept-Encoding': 'gzip, deflate'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.headers['Content-Type'] == 'text/css'
+        assert gzip.GzipFile(fileobj=io.BytesIO(response.body)).read() == self.css
+        response = self.fetch_static('/static/app.css', **{'Accept-Encoding': 'gzip, br'})
+        assert response.headers['Content-Encoding'] == 'br'
+        assert response.body == b'pretend this is brotli'
+        response = self.fetch_static('/static/app.css', **{'Accept-Encoding': 'br;q=0'})
+        assert response.body == self.css
+
+    def test_conditional(self):
+        response = self.fetch_static('/static/big.bin')
+        response = self.fetch_static('/static/big.bin', **{'If-None-Match': response.headers['Etag']})
+        assert response.code == 304
+        response = self.fetch_static('/static/big.bin', Range='bytes=10-19')
+        assert response.code == 206
+        assert response.body == self.big[10:20]
+
+    def test_static_url(self):
+        import hashlib
+        url = self.app.static_url('app.css')
+        assert url == '/static/app.css?v=' + hashlib.md5(self.css).hexdigest()
+        response = self.fetch_static(url)
+        assert response.body == self.css
+        assert 'max-age' in response.headers['Cache-Control']
+
+
+class TestUpstream(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        from tornado_smack.upstream import UpstreamClient
+        self.app = App(metrics_url='/metrics',
+                       upstream=UpstreamClient(max_per_host=2, queue_timeout=0.2))
+        self.app.debug = False
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+        @self.app.route("/slow/<t>")
+        @coroutine
+        def slow(self_, t):
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+            yield gen.sleep(float(t))
+            self.in_flight -= 1
+            self_.write(t)
+
+        @self.app.route("/fanout/<n>/<t>")
+        @coroutine
+        def fanout(self_, n, t):
+            responses = yield [self_.upstream.fetch(self.get_url('/slow/%s' % t))
+                               for i in range(int(n))]
+            self_.write({'bodies': [r.body.decode('utf-8') for r in responses]})
+
+        if sys.version_info >= (3, 5):
+            namespace = {'handler': handler, 'url': self.get_url('/slow/0')}
+            exec('''async def proxy():
+    response = await handler.upstream.fetch(url)
+    return response.body''', namespace)
+            self.app.add_route("/proxy", fn=namespace['proxy'])
+
+        return self.app._make_application(tornado.web.Application)
+
+    def test_per_host_limit(self):
+        response = self.fetch('/fanout/5/0.01')
+        assert json.loads(response.body) == {'bodies': ['0.01'] * 5}
+        assert self.most_in_flight == 2
+        host = '127.0.0.1:%d' % self.get_http_port()
+        stats = self.app.upstream.stats()[host]
+        assert stats == dict(in_flight=0, queued=0, requests=5, errors=0, queue_timeouts=0)
+        assert 'smack_upstream_requests_total{host="%s"} 5' % host in self.fetch('/metrics').body.decode('utf-8')
+
+    def test_queue_timeout(self):
+        response = self.fetch('/fanout/3/0.5')
+        assert response.code == 500
+        host = '127.0.0.1:%d' % self.get_http_port()
+        assert self.app.upstream.stats()[host]['queue_timeouts'] == 1
+
+    @unittest.skipIf(sys.version_info < (3, 5), 'needs async def')
+    def test_handler_proxy(self):
+        assert self.fetch('/proxy').body == b'0'
+
+    def test_made_when_needed(self):
+        from tornado_smack.upstream import UpstreamClient
+        app = App()
+
+        @app.route("/host")
+        def host():
+            return str(handler.upstream.max_per_host)
+
+        client = app.test_client()
+        # compiling routes doesn't make a client
+        assert app._upstream is None
+        assert client.get('/host').body == b'10'
+        # and handlers see the one set later
+        app.upstream = UpstreamClient(max_per_host=3)
+        assert client.get('/host').body == b'3'
+        client.close()
+
+
+class TestCoalesce(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.app = App()
+        self.app.debug = False
+        self.calls = []
+
+        @self.app.route("/slow/<id>", coalesce=['page'])
+        @coroutine
+        def slow(self_, id):
+            self.calls.append((id, self_.get_argument('page', None)))
+            yield gen.sleep(0.1)
+            self_.set_header('X-Id', id)
+            self_.write({'id': id, 'calls': len(self.calls)})
+
+        @self.app.route("/fails", coalesce=True)
+        @coroutine
+        def fails(self_):
+            self.calls.append('fails')
+            yield gen.sleep(0.1)
+            raise tornado.web.HTTPError(503)
+
+        @self.app.route("/login", coalesce=True)
+        @coroutine
+        def login(self_):
+            self.calls.append('login')
+            yield gen.sleep(0.1)
+            self_.set_cookie('session', 'user-%d' % self.calls.count('login'))
+            self_.write('ok')
+
+        @self.app.route("/article", coalesce=True)
+        @coroutine
+        def article(self_):
+            self.calls.append('article')
+            yield gen.sleep(0.1)
+            self_.write('article')
+
+        return self.app._make_application(tornado.web.Application)
+
+    @gen_test
+    def test_coalesce(self):
+        fetch = lambda path: self.http_client.fetch(self.get_url(path), raise_error=False)
+        responses = yield [fetch('/slow/1'), fetch('/slow/1?other=x'), fetch('/slow/1'),
+                           fetch('/slow/2'), fetch('/slow/1?page=2')]
+        assert len(self.calls) == 3
+        assert set(self.calls) == set([('1', None), ('1', '2'), ('2', None)])
+        for response in responses[:3]:
+            assert json.loads(response.body)['id'] == '1'
+            assert response.headers['X-Id'] == '1'
+        assert json.loads(responses[3].body)['id'] == '2'
+        assert self.app.get_routes()[0][1]._coalescer.stats() == dict(
+            executions=3, coalesced=2, in_flight=0)
+        # once it's done, the view is called again
+        yield fetch('/slow/1')
+        assert len(self.calls) == 4
+
+    @gen_test
+    def test_errors_are_shared(self):
+        responses = yield [self.http_client.fetch(self.get_url('/fails'), raise_error=False)
+                           for i in range(3)]
+        assert [response.code for response in responses] == [503] * 3
+        assert self.calls == ['fails']
+
+    @gen_test
+    def test_cookies_are_not_shared(self):
+        responses = yield [self.http_client.fetch(self.get_url('/login')) for i in range(2)]
+        cookies = sorted(response.headers['Set-Cookie'].split(';')[0] for response in responses)
+        assert cookies == ['session=user-1', 'session=user-2']
+        assert self.calls == ['login', 'login']
+
+    @gen_test
+    def test_not_modified_is_not_shared(self):
+        etag = (yield self.http_client.fetch(self.get_url('/article'))).headers['Etag']
+        conditional = self.http_client.fetch(self.get_url('/article'), raise_error=False,
+                                             headers={'If-None-Match': etag})
+        yield gen.sleep(0.05)
+        plain = self.http_client.fetch(self.get_url('/article'), raise_error=False)
+        conditional, plain = yield [conditional, plain]
+        assert conditional.code == 304
+        assert plain.code == 200 and plain.body == b'article'
+        assert self.calls == ['article'] * 3
+
+
+class TestAdmission(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.app = App(max_concurrency=3, max_queue=0, retry_after=5, metrics_url='/metrics')
+        self.app.debug = False
+        self.running = []
+        self.most = 0
+
+        @self.app.route("/slow/<id>", max_concurrency=1, max_queue=1)
+        @coroutine
+        def slow(self_, id):
+            self.running.append(id)
+            self.most = max(self.most, len(self.running))
+            yield gen.sleep(0.1)
+            self.running.remove(id)
+            self_.write(id)
+
+        @self.app.route("/other/<id>")
+        @coroutine
+        def other(self_, id):
+            yield gen.sleep(0.1)
+            self_.write(id)
+
+        return self.app._make_application(tornado.web.Application)
+
+    @gen_test
+    def test_route_limit(self):
+        fetch = lambda path: self.http_client.fetch(self.get_url(path), raise_error=False)
+        responses = yield [fetch('/slow/%d' % i) for i in range(3)]
+        codes = sorted(response.code for response in responses)
+        assert codes == [200, 200, 503]
+        # one ran, one waited for it, the last one was turned away
+        assert self.most == 1
+        shed = [response for response in responses if response.code == 503][0]
+        assert shed.headers['Retry-After'] == '5'
+        stats = self.app.admission.stats()
+        assert stats['/slow/<id>'] == dict(in_flight=0, queued=0, admitted=2, shed=1,
+                                           max_concurrency=1, max_queue=1)
+        assert stats[None]['in_flight'] == 0
+        response = yield fetch('/metrics')
+        assert b'smack_admission_shed_total{route="/slow/<id>"} 1' in response.body
+
+    @gen_test
+    def test_app_limit(self):
+        fetch = lambda path: self.http_client.fetch(self.get_url(path), raise_error=False)
+        responses = yield [fetch('/other/%d' % i) for i in range(5)]
+        assert sorted(response.code for response in responses) == [200] * 3 + [503] * 2
+        assert self.app.admission.stats()[None]['shed'] == 2
+        # the metrics are not limited, and slots are given back
+        responses = yield [fetch('/other/%d' % i) for i in range(3)] + [fetch('/metrics')]
+        assert [response.code for response in responses] == [200] * 4
+
+
+class TestBatch(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.app = App(batch_url='/_batch', metrics_url='/metrics', batch_max_requests=5)
+        self.app.debug = False
+
+        @self.app.route("/articles/<int:id>")
+        @coroutine
+        def article(self_, id):
+            yield gen.sleep(0.2)
+            self_.write({'id': id, 'user': self_.request.headers.get('X-User'),
+                         'lang': self_.request.headers.get('Accept-Language'),
+                         'page': self_.get_argument('page', None)})
+
+        @self.app.route("/missing")
+        def missing():
+            raise tornado.web.HTTPError(404)
+
+        @self.app.route("/change", methods=['POST'])
+        def change():
+            return 'changed'
+
+        return self.app._make_application(tornado.web.Application)
+
+    def post(self, body, **headers):
+        return self.http_client.fetch(self.get_url('/_batch'), method='POST', raise_error=False,
+                                      body=json.dumps(body), headers=headers)
+
+    @gen_test
+    def test_batch(self):
+        started = time.time()
+        response = yield self.post({'requests': [
+            {'path': '/articles/1?page=2'},
+            {'path': '/articles/2', 'headers': {'Accept-Language': 'tr'}},
+            {'path': '/missing'},
+            {'path': '/metrics'},
+            {'path': '/change', 'method': 'POST'},
+            ]}, **{'X-User': 'ali'})
+        # they ran at the same time
+        assert time.time() - started < 0.4
+        assert response.code == 200
+        first, second, missing, metrics, change = json.loads(response.body)['responses']
+        assert first['status'] == 200
+        assert json.loads(first['body']) == {'id': '1', 'user': 'ali', 'lang': None, 'page': '2'}
+        assert first['headers']['Content-Type'].startswith('application/json')
+        assert json.loads(second['body'])['lang'] == 'tr'
+        assert missing['status'] == 404
+        # not one of our routes
+        assert metrics['status'] == 404
+        assert change['status'] == 405
+        assert self.app.metrics.routes['/articles/<int:id>'].statuses == {200: 2}
+
+    @gen_test
+    def test_bad_batches(self):
+        response = yield self.post({'requests': [{'path': '/articles/1'}] * 6})
+        assert response.code == 400
+        response = yield self.post({'no': 'requests'})
+        assert response.code == 400
+        response = yield self.post([{'nopath': 1}, 'foo'])
+        assert [result['status'] for result in json.loads(response.body)['responses']] == [400, 400]
+
+    @gen_test
+    def test_malformed_sub_requests(self):
+        response = yield self.post([{'path': '/articles/1'},
+                                    {'path': '/articles/1', 'method': 1},
+                                    {'path': '/articles/1', 'headers': ['Accept']},
+                                    {'path': '/articles/1', 'headers': {'X-Page': 2}}])
+        assert response.code == 200
+        assert [result['status'] for result in json.loads(response.body)['responses']] == [
+            200, 400, 400, 400]
+
+
+class TestTimeout(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.app = App(timeout=0.2, metrics_url='/metrics')
+        self.app.debug = False
+        self.woke = []
+
+        @self.app.route("/sleep/<t>", max_concurrency=1)
+        @coroutine
+        def sleep(self_, t):
+            yield gen.sleep(float(t))
+            self.woke.append(t)
+            self_.write(t)
+
+        @self.app.route("/queued/<t>", max_concurrency=1, max_queue=1)
+        @coroutine
+        def queued(self_, t):
+            yield gen.sleep(float(t))
+            self_.write(t)
+
+        @self.app.route("/stream/<t>")
+        @coroutine
+        def stream(self_, t):
+            self_.write('0\n')
+            yield self_.flush()
+            yield gen.sleep(float(t))
+            self_.write('1\n')
+
+        @self.app.route("/patient/<t>", timeout=0)
+        @coroutine
+        def patient(self_, t):
+            yield gen.sleep(float(t))
+            self_.write(t)
+
+        if sys.version_info >= (3, 5):
+            namespace = {'gen': gen, 'woke': self.woke}
+            exec('''async def wrapped(t):
+    await gen.sleep(float(t))
+    woke.append(t)
+    return {'t': t}''', namespace)
+            self.app.add_route("/wrapped/<t>", fn=namespace['wrapped'], timeout=0.1)
+
+        return self.app._make_application(tornado.web.Application)
+
+    @gen_test
+    def test_timeout(self):
+        fetch = lambda path: self.http_client.fetch(self.get_url(path), raise_error=False)
+        started = time.time()
+        response = yield fetch('/sleep/0.6')
+        assert response.code == 504
+        assert time.time() - started < 0.5
+        # its slot is free again, even though the view is still sleeping
+        response = yield fetch('/sleep/0.01')
+        assert response.code == 200 and response.body == b'0.01'
+        assert self.woke == ['0.01']
+        response = yield fetch('/patient/0.3')
+        assert response.code == 200
+        routes = self.app.metrics.routes
+        assert routes['/sleep/<t>'].timeouts == 1
+        assert routes['/patient/<t>'].timeouts == 0
+        response = yield fetch('/metrics')
+        assert b'smack_timeouts_total{route="/sleep/<t>"} 1' in response.body
+        # the abandoned view wakes up, what it writes goes nowhere
+        yield gen.sleep(0.5)
+        assert self.woke == ['0.01', '0.6']
+
+    @gen_test
+    def test_timeout_while_queued(self):
+        fetch = lambda path: self.http_client.fetch(self.get_url(path), raise_error=False)
+        started = time.time()
+        responses = yield [fetch('/queued/0.6'), fetch('/queued/0.6')]
+        # the one waiting for the slot doesn't get a deadline of its own once it has it
+        assert [response.code for response in responses] == [504, 504]
+        assert time.time() - started < 0.35
+        # the slot isn't kept by the request we gave up on
+        response = yield fetch('/queued/0.01')
+        assert response.code == 200
+        assert self.app.admission.stats()['/queued/<t>']['in_flight'] == 0
+
+    @gen_test
+    def test_timeout_while_streaming(self):
+        from tornado.httpclient import HTTPError
+        # the connection is closed, the client knows the response was cut off
+        try:
+            response = yield self.http_client.fetch(self.get_url('/stream/0.4'),
+                                                    raise_error=False)
+            code = response.code
+        except HTTPError as e:
+            # tornado 6 raises it even without raise_error
+            code = e.code
+        assert code == 599
+        assert self.app.metrics.routes['/stream/<t>'].timeouts == 1
+        response = yield self.http_client.fetch(self.get_url('/stream/0.01'))
+        assert response.body == b'0\n1\n'
+
+    @unittest.skipIf(sys.version_info < (3, 5), 'needs async def')
+    @gen_test
+    def test_wrapped_view(self):
+        fetch = lambda path: self.http_client.fetch(self.get_url(path), raise_error=False)
+        slow, fast = yield [fetch('/wrapped/0.3'), fetch('/wrapped/0.01')]
+        assert slow.code == 504
+        assert json.loads(fast.body) == {'t': '0.01'}
+        yield gen.sleep(0.4)
+        assert self.woke == ['0.01', '0.3']
+        assert self.app.metrics.routes['/wrapped/<t>'].timeouts == 1
+
+
+class TestRouteTable(unittest.TestCase):
+
+    def test_compiled_once(self):
+        app = App()
+
+        @app.route("/foo/<slug>")
+        def foo(slug):
+            return slug
+
+        routes = app.get_routes()
+        assert app.get_routes() == routes
+        assert len(list(app.url_map.iter_rules())) == 1
+
+        @app.route("/bar", methods=['GET', 'POST'])
+        def bar():
+            return "bar"
+
+        new_routes = app.get_routes()
+        assert new_routes[0] == routes[0]
+        assert len(new_routes) == 2
+        assert new_routes[1][1].__name__ == 'BarHandler'
+
+        # handler bases depend on debug, so this compiles again
+        app.debug = False
+        assert app.get_routes()[0][1] is not routes[0][1]
+
+    def test_lazy_imports(self):
+        import os
+        import subprocess
+        code = ("import sys\n"
+                "from tornado_smack import App\n"
+                "app = App()\n"
+                "app.route('/plain')(lambda: 'plain')\n"
+                "app.debug = False\n"
+                "app.get_routes()\n"
+                "print(app.template_path)\n"
+                "print(' '.join(m for m in ('werkzeug.routing', 'werkzeug.local', 'tornado.wsgi',"
+                " 'tornado_smack.profiling') if m in sys.modules))\n")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.check_output([sys.executable, '-c', code], env=env).decode()
+        template_path, loaded = (output.split('\n') + [''])[:2]
+        # the caller's templates
+        assert template_path == os.path.realpath('templates')
+        if sys.version_info >= (3, 7) and tornado.version_info >= (5,):
+            assert loaded == ''
+
+        # a file of ours calling App()
+        assert App().template_path == os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                                   'templates')
+
+
+class TestHandlerContext(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        app = App()
+        app.debug = False
+        self.later = seen_later = []
+
+        @app.route("/path/<t>")
+        def path(t):
+            @coroutine
+            def later():
+                yield gen.sleep(float(t))
+                seen_later.append(handler.request.path)
+            later()
+            return handler.request.path
+
+        @app.route("/identity")
+        def identity():
+            current = handler._get_current_object()
+            assert isinstance(handler, tornado.web.RequestHandler)
+            assert handler == current and not handler != current
+            assert {current: 'found'}[handler] == 'found'
+            assert handler in set([current])
+            return 'ok'
+
+        if sys.version_info >= (3, 5):
+            # python 2 can't parse async def
+            namespace = {'handler': handler, 'gen': gen}
+            exec('''async def async_path(t):
+    await gen.sleep(float(t))
+    return {'path': handler.request.path}''', namespace)
+            app.add_route("/async/<t>", fn=namespace['async_path'])
+
+        return app._make_application(tornado.web.Application)
+
+    def test_handler_proxy(self):
+        response = self.fetch('/path/0')
+        assert response.body == b'/path/0'
+        self.assertRaises(RuntimeError, lambda: handler.request)
+
+    @gen_test
+    def test_callbacks_keep_their_handler(self):
+        client = self.http_client
+        slow, fast = yield [client.fetch(self.get_url('/path/0.2')),
+                            client.fetch(self.get_url('/path/0.01'))]
+        assert (slow.body, fast.body) == (b'/path/0.2', b'/path/0.01')
+        yield gen.sleep(0.3)
+        # they ran after their requests finished, each one still sees its own
+        assert self.later == ['/path/0.01', '/path/0.2']
+
+    def test_handler_identity(self):
+        assert self.fetch('/identity').body == b'ok'
+        assert not isinstance(handler, tornado.web.RequestHandler)
+
+    @unittest.skipIf(sys.version_info < (3, 5), 'needs async def')
+    @gen_test
+    def test_async_view(self):
+        client = self.http_client
+        slow, fast = yield [client.fetch(self.get_url('/async/0.2')),
+                            client.fetch(self.get_url('/async/0.01'))]
+        assert json.loads(slow.body) == {'path': '/async/0.2'}
+        assert json.loads(fast.body) == {'path': '/async/0.01'}
+
+
+class TestTrieRouter(unittest.TestCase):
+
+    def test_same_matches_as_tornado(self):
+        import tornado.web
+        from tornado.httputil import HTTPServerRequest
+
+        def make_app(dispatcher):
+            app = App(dispatcher=dispatcher)
+
+            @app.route("/foo/<slug>")
+            def slug(slug):
+                return slug
+
+            @app.route("/foo/bar")
+            def bar():
+                return "bar"
+
+            @app.route("/get/<int:id>/<int:w>")
+            def get(id, w):
+                return id
+
+            @app.route("/files/<path:p>")
+            def files(p):
+                return p
+
+            @app.route("/dir/")
+            def directory():
+                return "dir"
+
+            @app.route(r"/entry/([^/]+)")
+            def entry(e):
+                return e
+
+            @app.route("/page/<int(min=1):n>")
+            def page(n):
+                return n
+
+            @app.route("/v<version>/info")
+            def info(version):
+                return version
+
+            return app
+
+        regex_app = make_app('regex')._make_application(tornado.web.Application)
+        trie_app = make_app('trie')._make_application(tornado.web.Application)
+
+        for path in ['/foo/bar', '/foo/baz', '/foo/b%20z', '/get/1/2', '/get/a/2',
+                     '/files/a/b/c', '/dir', '/dir/', '/entry/1', '/nothing', '/', '//foo/bar',
+                     '/page/3', '/page/0', '/v2/info']:
+            request = HTTPServerRequest(method='GET', uri=path)
+            expected = regex_app.find_handler(request)
+            found = trie_app.find_handler(request)
+            assert found.handler_class.__name__ == expected.handler_class.__name__, path
+            assert found.path_args == expected.path_args, path
+            assert found.path_kwargs == expected.path_kwargs, path
+
+    def test_indexed_rules(self):
+        from werkzeug.routing import Map, Rule
+        from tornado_smack.routing import TrieRouter
+        rules = [Rule('/page/<int(min=1):n>'), Rule('/v<version>/info'), Rule('/files/<path:p>')]
+        Map(rules)
+        router = TrieRouter(None, [('', rule, None) for rule in rules])
+        # variables in the middle of a segment and paths are tried one by one
+        assert [route.index for route in router.fallback] == [1, 2]
 
 
 if __name__ == '__main__':
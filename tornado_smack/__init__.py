@@ -1 +1,2 @@
 from .app import App, render_template, handler
+from .cache import CachePolicy, Coalescer
@@ -0,0 +1,169 @@
+"""
+    smack.admission
+    ~~~~~~~~~~~~~~~
+
+    limits how many requests of a route, or of the whole app, run at once::
+
+        app = App(max_concurrency=500, max_queue=1000)
+
+        @app.route("/search", max_concurrency=20, max_queue=50)
+        def search():
+            ...
+
+    requests above max_concurrency wait in a queue of max_queue, the ones that
+    don't fit in it get a 503 with a Retry-After header right away, without
+    calling the view. when a backend slows down we answer the requests we can
+    in time and turn the others away, instead of piling them all up.
+"""
+
+from collections import deque
+from tornado import gen
+from tornado.concurrent import Future
+from .metrics import escape_label
+
+
+class AdmissionHandlerMixin(object):
+    """
+    gives the slots of the handler back when it is finished
+    """
+    _limiters = ()
+
+    def on_finish(self):
+        limiters = self._limiters
+        self._limiters = ()
+        for limiter in limiters:
+            limiter.release()
+        super(AdmissionHandlerMixin, self).on_finish()
+
+
+class Limiter(object):
+    """
+    :param max_concurrency: requests running at once
+    :param max_queue: requests waiting for one of them to finish, the others are shed
+    :param retry_after: seconds we tell the clients we shed to wait
+    """
+    def __init__(self, max_concurrency, max_queue=0, retry_after=1):
+        assert max_concurrency > 0
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.shed = 0
+
+    @property
+    def queued(self):
+        return len(self.waiters)
+
+    def admit(self):
+        """
+        True if a request can run now, a future resolved when it can, or False if
+        it has to be shed
+        """
+        if self.in_flight < self.max_concurrency:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        if len(self.waiters) >= self.max_queue:
+            self.shed += 1
+            return False
+        future = Future()
+        self.waiters.append(future)
+        return future
+
+    def release(self):
+        if self.waiters:
+            # the slot goes to the first one waiting, in_flight stays the same
+            self.admitted += 1
+            self.waiters.popleft().set_result(None)
+        else:
+            self.in_flight -= 1
+
+    def reject(self, handler):
+        handler.set_status(503)
+        handler.set_header('Retry-After', str(self.retry_after))
+        handler.finish()
+
+    def stats(self):
+        return dict(in_flight=self.in_flight, queued=self.queued, admitted=self.admitted,
+                    shed=self.shed, max_concurrency=self.max_concurrency,
+                    max_queue=self.max_queue)
+
+    @gen.coroutine
+    def wait(self, handler, future, method, args, kwargs):
+        yield future
+        if handler._finished:
+            # we gave up on it meanwhile, its deadline passed
+            self.release()
+            return
+        handler._limiters += (self,)
+        result = method(handler, *args, **kwargs)
+        if result is not None:
+            yield result
+
+    def wrap(self, method):
+        """
+        returns a handler method that calls method when the request is admitted
+        """
+        limiter = self
+
+        def limited(self, *args, **kwargs):
+            admitted = limiter.admit()
+            if admitted is True:
+                self._limiters += (limiter,)
+                return method(self, *args, **kwargs)
+            if admitted is False:
+                return limiter.reject(self)
+            return limiter.wait(self, admitted, method, args, kwargs)
+        return limited
+
+
+class Admission(object):
+    """
+    the limiters of an app, the app-wide one and those of its routes.
+
+    :param max_concurrency: requests of all routes running at once, None for no limit
+    :param max_queue: requests of all routes waiting for their turn
+    :param retry_after: seconds we tell the clients we shed to wait
+    """
+    def __init__(self, max_concurrency=None, max_queue=0, retry_after=1):
+        self.retry_after = retry_after
+        self.app = Limiter(max_concurrency, max_queue, retry_after) if max_concurrency else None
+        self.routes = {}
+
+    def route(self, route, max_concurrency, max_queue=0):
+        """
+        returns the Limiter of route, we keep it while its limits stay the same
+        so its counters survive compiling our routes again
+        """
+        limiter = self.routes.get(route)
+        if limiter is None or (limiter.max_concurrency, limiter.max_queue) != (max_concurrency,
+                                                                               max_queue):
+            limiter = self.routes[route] = Limiter(max_concurrency, max_queue, self.retry_after)
+        return limiter
+
+    def stats(self):
+        "route -> counters of its limiter, None for the app-wide one"
+        stats = dict((route, limiter.stats()) for route, limiter in self.routes.items())
+        if self.app is not None:
+            stats[None] = self.app.stats()
+        return stats
+
+    def render(self):
+        "our stats in the prometheus text format, as lines"
+        limiters = sorted(self.routes.items())
+        if self.app is not None:
+            # the app-wide one has no route label
+            limiters.insert(0, (None, self.app))
+        lines = []
+        for name, kind in (('in_flight', 'gauge'), ('queued', 'gauge'), ('admitted', 'counter'),
+                           ('shed', 'counter')):
+            metric = 'smack_admission_%s' % name
+            if kind == 'counter':
+                metric += '_total'
+            lines.append('# TYPE %s %s' % (metric, kind))
+            for route, limiter in limiters:
+                labels = '' if route is None else '{route="%s"}' % escape_label(route)
+                lines.append('%s%s %d' % (metric, labels, getattr(limiter, name)))
+        return lines
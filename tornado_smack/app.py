@@ -5,27 +5,50 @@
     debug interface stolen from: https://gist.github.com/rduplain/4983839
 """
 
+import tornado
 import tornado.ioloop
 import tornado.web
-import tornado.wsgi
 import contextlib
 import functools
-from tornado.stack_context import StackContext
-from functools import partial
-from werkzeug.routing import Map, Rule, _rule_re
+from tornado import gen
+from tornado.iostream import StreamClosedError
 import os
+import re
+import sys
 import inspect
-from werkzeug.local import LocalStack, LocalProxy
 import logging
+import weakref
+from datetime import timedelta
 from collections import OrderedDict
+from .lru import LRUDict
+from .cache import CachedHandlerMixin, CoalescingHandlerMixin, Coalescer
+from .encoding import get_json_encoder, is_dataclass_instance
+from .metrics import Metrics, MetricsHandlerMixin, MetricsHandler, timer as _timer
+from .admission import Admission, AdmissionHandlerMixin
 
+# werkzeug, tornado.wsgi and friends are only needed in debug mode or for some
+# routes, we import them when we get there, so importing us and creating apps is quick.
+
+# tornado.wsgi.WSGIAdapter is there from tornado 4 up to 6
+with_wsgi_adapter = (4,) <= tornado.version_info < (6,)
 
 try:
-    from tornado.wsgi import WSGIAdapter
-except:
-    with_wsgi_adapter = False
-else:
-    with_wsgi_adapter = True
+    from urllib.parse import urlencode
+except ImportError:
+    # python 2
+    from urllib import urlencode
+
+try:
+    _end_of_chunks = (StopIteration, StopAsyncIteration)
+except NameError:
+    # python < 3.5, no async generators either
+    _end_of_chunks = (StopIteration,)
+
+try:
+    import contextvars
+except ImportError:
+    # python < 3.7
+    contextvars = None
 
 logger = logging.getLogger(__name__)
 try:
@@ -34,24 +57,272 @@ except Exception as e:
     # python 2.6
     pass
 
+# since tornado 5 the ioloop runs on asyncio, which carries contextvars over to
+# the callbacks and tasks a view schedules, so we don't need StackContext there.
+with_contextvars = contextvars is not None and tornado.version_info >= (5, 0)
+
+if with_contextvars:
+    _handler_var = contextvars.ContextVar('tornado_smack.handler')
+else:
+    from werkzeug.local import LocalStack
+    from tornado.stack_context import StackContext
+    _handler_ctx_stack = LocalStack()
+
 def _lookup_handler_object(name):
-    top = _handler_ctx_stack.top
+    if with_contextvars:
+        top = _handler_var.get(None)
+    else:
+        top = _handler_ctx_stack.top
     if top is None:
         raise RuntimeError('working outside of request context')
     return top
 
-_handler_ctx_stack = LocalStack()
+class _HandlerProxy(object):
+    """
+    forwards everything to the current request handler, like werkzeug's LocalProxy
+    which we don't want to import just for this.
+    """
+    __slots__ = ()
+
+    def _get_current_object(self):
+        return _lookup_handler_object('handler')
+
+    @property
+    def __class__(self):
+        # so isinstance(handler, RequestHandler) holds
+        try:
+            return self._get_current_object().__class__
+        except RuntimeError:
+            return type(self)
+
+    def __getattr__(self, name):
+        return getattr(self._get_current_object(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get_current_object(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._get_current_object(), name)
+
+    def __dir__(self):
+        try:
+            return dir(self._get_current_object())
+        except RuntimeError:
+            return []
+
+    def __repr__(self):
+        try:
+            return repr(self._get_current_object())
+        except RuntimeError:
+            return '<%s unbound>' % self.__class__.__name__
+
+    def __bool__(self):
+        try:
+            return bool(self._get_current_object())
+        except RuntimeError:
+            return False
+    __nonzero__ = __bool__
+
+    def __eq__(self, other):
+        return self._get_current_object() == other
+
+    def __ne__(self, other):
+        return self._get_current_object() != other
+
+    def __hash__(self):
+        return hash(self._get_current_object())
 
 """
 proxy to the current request handler object.
 """
-handler = LocalProxy(partial(_lookup_handler_object, 'handler'))
+handler = _HandlerProxy()
 
 @contextlib.contextmanager
 def ctx_man(ctx):
     _handler_ctx_stack.push(ctx)
-    yield
-    _handler_ctx_stack.pop()
+    try:
+        yield
+    finally:
+        _handler_ctx_stack.pop()
+
+def _call_view(handler, fn, args, kwargs):
+    _handler_var.set(handler)
+    return fn(*args, **kwargs)
+
+def _call_async_view(handler, fn, args, kwargs):
+    _handler_var.set(handler)
+    # the task has to be created here to run in our context
+    return gen.convert_yielded(fn(*args, **kwargs))
+
+def _call_view_on_stack(handler, fn, args, kwargs):
+    # LocalStack is thread local, so we push it in the worker thread
+    _handler_ctx_stack.push(handler)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _handler_ctx_stack.pop()
+
+def _submit_view(handler, executor, fn, args, kwargs):
+    """
+    runs fn in executor with handler as the current request handler,
+    returns a concurrent future for the result.
+    """
+    if with_contextvars:
+        return executor.submit(contextvars.copy_context().run, _call_view, handler, fn, args, kwargs)
+    return executor.submit(_call_view_on_stack, handler, fn, args, kwargs)
+
+def _is_process_pool(executor):
+    # if nobody imported it, executor can't be one
+    process = sys.modules.get('concurrent.futures.process')
+    return process is not None and isinstance(executor, process.ProcessPoolExecutor)
+
+def _submit_to_process(executor, fn, args, kwargs):
+    # there is no handler in another process, we only send the arguments
+    return executor.submit(fn, *args, **kwargs)
+
+def _run_view(handler, fn, args, kwargs, is_async=False):
+    """
+    calls fn with handler as the current request handler. for async views
+    returns a future for the result.
+    """
+    if with_contextvars:
+        call = _call_async_view if is_async else _call_view
+        # every request gets its own copy of the context, set() doesn't leak out of it
+        return contextvars.copy_context().run(call, handler, fn, args, kwargs)
+    with StackContext(functools.partial(ctx_man, handler)):
+        result = fn(*args, **kwargs)
+        if is_async:
+            result = gen.convert_yielded(result)
+    return result
+
+@gen.coroutine
+def _stream_template(self, chunks):
+    """
+    writes the chunks of a jinja2 template, flushing them every _stream_chunk_size
+    characters. flush waits until the client has taken the previous ones.
+    """
+    chunk_size = self._stream_chunk_size
+    metrics = self._metrics
+    buffered = []
+    size = 0
+    # time spent rendering, not waiting for the client
+    spent = 0
+    started = _timer()
+    try:
+        for chunk in chunks:
+            buffered.append(chunk)
+            size += len(chunk)
+            if size >= chunk_size:
+                self.write(u''.join(buffered))
+                buffered = []
+                size = 0
+                spent += _timer() - started
+                yield self.flush()
+                started = _timer()
+        if buffered:
+            self.write(u''.join(buffered))
+        spent += _timer() - started
+        self.finish()
+    except StreamClosedError:
+        # client has gone away, nothing left to do
+        pass
+    if metrics is not None:
+        metrics.observe_template(spent)
+
+_isasyncgen = getattr(inspect, 'isasyncgen', lambda result: False)
+
+@gen.coroutine
+def _stream_view(self, chunks):
+    """
+    writes the chunks a generator view yields, flushing them every _stream_chunk_size
+    characters, or the chunks of an async generator one by one, since it waits for
+    something between them. flush waits until the client has taken the previous ones,
+    so we only hold a few chunks at once.
+    """
+    is_async = _isasyncgen(chunks)
+    chunk_size = self._stream_chunk_size
+    metrics = self._metrics
+    size = 0
+    # time spent making chunks, not waiting for the client
+    spent = 0
+    started = _timer()
+    try:
+        while True:
+            # the view runs again, as the current handler
+            try:
+                if is_async:
+                    chunk = yield _run_view(self, chunks.__anext__, (), {}, is_async=True)
+                else:
+                    chunk = _run_view(self, next, (chunks,), {})
+            except _end_of_chunks:
+                break
+            if self._finished:
+                # we gave up on the request
+                break
+            self.write(chunk)
+            size += len(chunk)
+            if is_async or size >= chunk_size:
+                size = 0
+                spent += _timer() - started
+                yield self.flush()
+                started = _timer()
+        spent += _timer() - started
+        if not self._finished:
+            self.finish()
+    except StreamClosedError:
+        # client has gone away, nothing left to do
+        pass
+    except Exception:
+        if not self._headers_written:
+            raise
+        # too late for an error page, finishing would make the cut off body look whole
+        self.log_exception(*sys.exc_info())
+        self.request.connection.close()
+    finally:
+        if is_async:
+            # its finally blocks run now, as the current handler, not when it is collected
+            yield _run_view(self, chunks.aclose, (), {}, is_async=True)
+        else:
+            chunks.close()
+    if metrics is not None:
+        metrics.observe_serialization(spent)
+
+def _finish_result(self, result):
+    """
+    finishes the request with the return value of a view, returns a future
+    if it isn't done yet.
+    """
+    if self._finished:
+        # the view finished the request itself, or we gave up on it
+        return None
+    metrics = self._metrics
+    if isinstance(result, TemplateProxy):
+        if self._template_engine == 'tornado':
+            if metrics is not None:
+                started = _timer()
+            self.render(*result.args, **result.kwargs)
+        else:
+            template = self._template_env.get_template(result.args[0])
+            if result.stream:
+                return _stream_template(self, template.generate(handler=self, **result.kwargs))
+            if metrics is not None:
+                started = _timer()
+            self.finish(template.render(handler=self, **result.kwargs))
+        if metrics is not None:
+            metrics.observe_template(_timer() - started)
+    elif inspect.isgenerator(result) or _isasyncgen(result):
+        return _stream_view(self, result)
+    elif isinstance(result, (dict, list)) or is_dataclass_instance(result):
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        if metrics is not None:
+            started = _timer()
+            result = self._json_encoder(result)
+            metrics.observe_serialization(_timer() - started)
+        else:
+            result = self._json_encoder(result)
+        self.finish(result)
+    else:
+        self.finish(result)
 
 
 def get_current_traceback():
@@ -63,6 +334,14 @@ def get_current_traceback():
                                       ignore_system_exceptions=True)
     return traceback
 
+class UrlForHandlerMixin(object):
+    "puts url_for in the namespace of tornado templates"
+
+    def get_template_namespace(self):
+        namespace = super(UrlForHandlerMixin, self).get_template_namespace()
+        namespace['url_for'] = self._url_for
+        return namespace
+
 class DebuggableHandler(tornado.web.RequestHandler):
 
     def write_error(self, status_code, **kwargs):
@@ -76,8 +355,45 @@ class DebuggableHandler(tornado.web.RequestHandler):
         html = traceback.render_full(**keywords).encode('utf-8', 'replace')
         return html.replace(b'WSGI', b'tornado')
 
+def _frame_size(frame):
+    "Approximate size of a debugger frame, with its locals."
+    size = sys.getsizeof(frame)
+    for value in getattr(frame, 'locals', {}).values():
+        try:
+            size += sys.getsizeof(value)
+        except Exception:
+            # proxies and such
+            size += 64
+    return size
+
+def _traceback_size(traceback):
+    return sys.getsizeof(traceback) + sum(_frame_size(frame) for frame in traceback.frames)
+
 class DebugApplication(tornado.web.Application):
-    "Tornado Application supporting werkzeug interactive debugger."
+    """
+    Tornado Application supporting werkzeug interactive debugger.
+
+    The debugger keeps tracebacks and their frames around so you can inspect them later,
+    we keep the most recently used ones, limited by these settings:
+
+    debug_max_tracebacks: 50 by default
+    debug_max_frames: 1000 by default
+    debug_max_bytes: roughly how much memory each of them can use, 32mb by default
+    """
+
+    def set_debug_app(self, debug_app):
+        "Use werkzeug's debug app, with bounded stores for tracebacks and frames."
+        max_bytes = self.settings.get('debug_max_bytes', 32 * 1024 * 1024)
+        debug_app.tracebacks = LRUDict(self.settings.get('debug_max_tracebacks', 50),
+                                       max_bytes, _traceback_size)
+        debug_app.frames = LRUDict(self.settings.get('debug_max_frames', 1000),
+                                   max_bytes, _frame_size)
+        self.debug_app = debug_app
+
+    def debug_stats(self):
+        "Sizes and eviction counters of the traceback and frame stores."
+        return dict(tracebacks=self.debug_app.tracebacks.stats(),
+                    frames=self.debug_app.frames.stats())
 
     def get_current_traceback(self):
         "Get the current Python traceback, keeping stack frames in debug app."
@@ -97,10 +413,11 @@ class DebugApplication(tornado.web.Application):
     if not with_wsgi_adapter:
         # these are needed for tornado < 4
         def __init__(self, *args, **kwargs):
+            import tornado.wsgi
             from werkzeug.debug import DebuggedApplication
-            self.debug_app = DebuggedApplication(app=self, evalex=True)
-            self.debug_container = tornado.wsgi.WSGIContainer(self.debug_app)
             super(DebugApplication, self).__init__(*args, **kwargs)
+            self.set_debug_app(DebuggedApplication(app=self, evalex=True))
+            self.debug_container = tornado.wsgi.WSGIContainer(self.debug_app)
 
         def __call__(self, request):
             if '__debugger__' in request.uri:
@@ -119,12 +436,109 @@ class DebugApplication(tornado.web.Application):
 
 
 
+def _with_deadline(method, timeout):
+    """
+    returns a handler method that gives up on method after timeout seconds and sends
+    a 504, or closes the connection if it has sent a part of its response already.
+    the view is abandoned, not stopped, whatever it writes later is dropped.
+    """
+    timeout = timedelta(seconds=timeout)
+
+    @gen.coroutine
+    def deadline(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        if result is None:
+            return
+        try:
+            # writing to the finished request raises these
+            yield gen.with_timeout(timeout, result,
+                                   quiet_exceptions=(RuntimeError, StreamClosedError))
+        except gen.TimeoutError:
+            if self._metrics is not None:
+                self._metrics.timeouts += 1
+            if self._finished:
+                return
+            if self._headers_written:
+                # too late for a 504, finishing would make the cut off body look whole
+                self.request.connection.close()
+            else:
+                self.send_error(504)
+    return deadline
+
+def _caller_filename():
+    """
+    the file of the code that called us, the first frame outside this module.
+    inspect.stack() would read the source lines of every frame for this.
+    """
+    frame = sys._getframe()
+    filename = frame.f_code.co_filename
+    while frame is not None and frame.f_code.co_filename == filename:
+        frame = frame.f_back
+    if frame is None:
+        return filename
+    return frame.f_code.co_filename
+
+_view_info = weakref.WeakKeyDictionary()
+
+def _inspect_view(fn):
+    """
+    returns (self_in_args, is_tornado_decorated, is_async) for a view function, we
+    remember it per function since get_routes can be called many times.
+    """
+    try:
+        return _view_info[fn]
+    except (KeyError, TypeError):
+        pass
+    if hasattr(inspect, 'getfullargspec'):
+        args = inspect.getfullargspec(fn).args
+    else:
+        args = inspect.getargspec(fn).args
+    self_in_args = bool(args) and args[0] in ['self', 'handler']
+    # are we using a tornado.coroutine or something similar
+    is_tornado = 'tornado' in (inspect.getsourcefile(fn) or '')
+    is_async = getattr(inspect, 'iscoroutinefunction', lambda fn: False)(fn)
+    info = (self_in_args, is_tornado, is_async)
+    try:
+        _view_info[fn] = info
+    except TypeError:
+        pass
+    return info
+
+
+_plain_path_re = re.compile(r'^/[\w/.~-]*$')
+
+def _path_builder(path):
+    "builds urls for a route without arguments, like Rule.build does"
+    def build(values):
+        if values:
+            return '', path + '?' + urlencode(values, doseq=True)
+        return '', path
+    return build
+
+
+def _handler_upstream(self):
+    "the UpstreamClient of the app whose route this is, made when it is first needed"
+    return self._app.upstream
+
 class TemplateProxy(object):
     def __init__(self, *args, **kwargs):
+        self.stream = kwargs.pop('stream', False)
         self.args = args
         self.kwargs = kwargs
 
 def render_template(*args, **kwargs):
+    """
+    return this from your view to render a template with the given arguments::
+
+        @app.route("/report")
+        def report():
+            return render_template("report.html", rows=rows)
+
+    with jinja2 you can pass stream=True, so the template is sent in chunks as it is
+    rendered instead of building the whole page in memory first. chunk size is set by
+    the stream_chunk_size parameter of :class:`App`. tornado templates are always
+    rendered at once.
+    """
     return TemplateProxy(*args, **kwargs)
 
 class App(object):
@@ -144,51 +558,359 @@ class App(object):
     :param debug: enables werkzeug debugger
     :param template_path: we normally look for template in ./templates folder of your app.py
                           you can explicitly set for some other template path
+    :param dispatcher: 'regex' lets tornado try our routes one by one, 'trie' makes :meth:`run`
+                       dispatch them with :class:`tornado_smack.routing.TrieRouter`, so
+                       lookups don't get slower as you add routes. needs tornado >= 4.5
+    :param template_mode: in 'production' mode every template is compiled when the server starts,
+                          see :meth:`precompile_templates`, and we never check if they changed
+                          on disk.
+    :param template_cache_path: where jinja2 keeps compiled templates in production mode,
+                                a temporary folder by default.
+    :param stream_chunk_size: how many characters of a streamed template, or of the chunks a
+                              generator view yields, we send at once
+    :param json_encoder: encodes the dicts, lists and dataclasses your views return. 'auto' uses
+                         orjson or ujson if you have them installed, see
+                         :func:`tornado_smack.encoding.get_json_encoder` for the others. you
+                         can also pass your own function returning str or bytes.
+    :param thread_executor: the executor views with executor='thread' run in, by default
+                            a ThreadPoolExecutor with thread_pool_size workers, created when
+                            it is first needed.
+    :param thread_pool_size: defaults to 5 threads per cpu
+    :param process_executor: the executor views with executor='process' run in, by default a
+                             ProcessPoolExecutor with process_pool_size workers, created
+                             when it is first needed, in each worker if you fork.
+    :param process_pool_size: defaults to one process per cpu
+    :param metrics: records the number of requests, status codes and how long the view,
+                    template and json encoding took for every route, see
+                    :class:`tornado_smack.metrics.Metrics`.
+    :param metrics_url: if set, we serve the metrics at this url in the prometheus text format
+    :param profile_secret: lets requests signed with this secret ask to be profiled, see
+                           :mod:`tornado_smack.profiling`. off if not set.
+    :param profile_dir: where profiles asked for with 'file' output are written
+    :param url_cache_size: how many urls :meth:`url_for` remembers
+    :param static_path: serves the files in this folder, see :mod:`tornado_smack.static`
+    :param static_url: the url they are served at
+    :param static_cache_bytes: memory we keep small static files in, when not in debug mode
+    :param static_cache_file_size: files bigger than this are always read from disk
+    :param upstream: the :class:`tornado_smack.upstream.UpstreamClient` your views can send
+                     requests to other services with, as handler.upstream. one with its
+                     default limits if not given.
+    :param max_concurrency: requests of all our routes running at once, None for no limit.
+                            see :mod:`tornado_smack.admission`.
+    :param max_queue: requests of all our routes waiting for one of them to finish, the
+                      others get a 503 right away
+    :param retry_after: seconds we tell the clients we turn away to wait, in the Retry-After
+                        header
+    :param timeout: seconds the views of our routes can take by default, None for no limit.
+                    see the timeout parameter of :meth:`route`.
+    :param batch_url: if set, clients can POST many requests to our routes at once to this
+                      url, see :mod:`tornado_smack.batch`
+    :param batch_max_requests: how many requests one batch can have
     """
-    def __init__(self, debug=False, template_path=None, template_engine='tornado'):
+    def __init__(self, debug=False, template_path=None, template_engine='tornado', dispatcher='regex',
+                 template_mode='development', template_cache_path=None, stream_chunk_size=16 * 1024,
+                 json_encoder='auto', thread_executor=None, thread_pool_size=None,
+                 process_executor=None, process_pool_size=None, metrics=True, metrics_url=None,
+                 profile_secret=None, profile_dir=None, url_cache_size=4096,
+                 static_path=None, static_url='/static/', static_cache_bytes=16 * 1024 * 1024,
+                 static_cache_file_size=256 * 1024, upstream=None, max_concurrency=None,
+                 max_queue=0, retry_after=1, timeout=None, batch_url=None, batch_max_requests=50):
         assert template_engine in ('tornado', 'jinja2')
+        assert dispatcher in ('regex', 'trie')
+        assert template_mode in ('development', 'production')
         self.registery = OrderedDict()
-        self.url_map = Map()
-        self.mapper = self.url_map.bind("", "/")
+        self.rules = {}
+        self.dispatcher = dispatcher
+        # werkzeug's, made when we add the first werkzeug route
+        self.url_map = None
+        self.mapper = None
         self.debug = True
         self.methods = []
+        # the debug setting our registery was compiled with, None if it is not compiled yet
+        self._compiled_debug = None
         self.routes_list = []
+        # endpoint -> [(arguments, build function of the rule)]
+        self._url_builders = {}
+        self._url_cache = LRUDict(url_cache_size)
 
         if not template_path:
-            frames = inspect.getouterframes(inspect.currentframe())
-            frame,filename,line_number,function_name,lines,index = frames[0]
-            for frame in frames:
-                if filename != frame[1]:
-                    filename = frame[1]
-                    break
-            self.template_path = os.path.realpath(os.path.join(os.path.dirname(filename), 'templates'))
+            self.template_path = os.path.realpath(os.path.join(os.path.dirname(_caller_filename()),
+                                                               'templates'))
         else:
             self.template_path = template_path
 
         self.template_engine = template_engine
+        self.template_mode = template_mode
+        self.template_loader = None
+        self.stream_chunk_size = stream_chunk_size
+        self.json_encoder = get_json_encoder(json_encoder)
+        self.thread_executor = thread_executor
+        self.thread_pool_size = thread_pool_size
+        self.process_executor = process_executor
+        self.process_pool_size = process_pool_size
+        self._process_executor_pid = None
+        self.metrics = Metrics() if metrics else None
+        self.metrics_url = metrics_url
+        if profile_secret:
+            from .profiling import Profiler
+            self.profiler = Profiler(profile_secret, profile_dir)
+        else:
+            self.profiler = None
+        self._upstream = None
+        if upstream is not None:
+            self.upstream = upstream
+        self.admission = Admission(max_concurrency, max_queue, retry_after)
+        self.timeout = timeout
+        self.batch_url = batch_url
+        self.batch_max_requests = batch_max_requests
+        # pattern of a route -> its compiled reg. exp., for match_route
+        self._route_regexes = {}
+        if self.metrics is not None:
+            self.metrics.collectors.append(self.admission)
+        self._templates_compiled = False
+        self.static_path = static_path
+        self.static_url_prefix = static_url
+        self.static_cache_bytes = static_cache_bytes
+        self.static_cache_file_size = static_cache_file_size
+        # made for the debug setting in _static_debug
+        self._static_handler_class = None
+        self._static_debug = None
 
         if template_engine == 'jinja2':
             from jinja2 import Environment, FileSystemLoader
-            self.template_env = Environment(loader=FileSystemLoader(self.template_path))
+            if template_mode == 'production':
+                from jinja2 import FileSystemBytecodeCache
+                # keep every template, don't stat them on each render
+                self.template_env = Environment(loader=FileSystemLoader(self.template_path),
+                                                auto_reload=False, cache_size=-1,
+                                                bytecode_cache=FileSystemBytecodeCache(template_cache_path))
+            else:
+                self.template_env = Environment(loader=FileSystemLoader(self.template_path))
+            self.template_env.globals['url_for'] = self.url_for
+            self.template_env.globals['static_url'] = self.static_url
+
+
+    @property
+    def upstream(self):
+        "our UpstreamClient, made when it is first needed"
+        if self._upstream is None:
+            from .upstream import UpstreamClient
+            self.upstream = UpstreamClient()
+        return self._upstream
+
+    @upstream.setter
+    def upstream(self, upstream):
+        if self.metrics is not None:
+            if self._upstream is not None:
+                self.metrics.collectors.remove(self._upstream)
+            self.metrics.collectors.append(upstream)
+        self._upstream = upstream
+
+    def get_executor(self, executor):
+        """
+        returns the executor for the executor parameter of a route, creating
+        our thread pool if needed.
+
+        :param executor: 'thread', 'process' or a concurrent.futures.Executor
+        """
+        if executor == 'thread':
+            if self.thread_executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                from tornado.process import cpu_count
+                self.thread_executor = ThreadPoolExecutor(self.thread_pool_size or cpu_count() * 5)
+            return self.thread_executor
+        if executor == 'process':
+            # a pool we forked with, or one that lost a process, is of no use
+            if (self.process_executor is None or getattr(self.process_executor, '_broken', False) or
+                    self._process_executor_pid not in (None, os.getpid())):
+                from concurrent.futures import ProcessPoolExecutor
+                self.process_executor = ProcessPoolExecutor(self.process_pool_size)
+                self._process_executor_pid = os.getpid()
+            return self.process_executor
+        return executor
+
+    def list_templates(self, template_path=None):
+        """
+        returns the names of the files in our template path, skipping hidden ones
+        """
+        template_path = template_path or self.template_path
+        names = []
+        for dirpath, dirnames, filenames in os.walk(template_path):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for filename in filenames:
+                if filename.startswith('.'):
+                    continue
+                path = os.path.relpath(os.path.join(dirpath, filename), template_path)
+                names.append(path.replace(os.path.sep, '/'))
+        return sorted(names)
+
+    def precompile_templates(self, **settings):
+        """
+        compiles every template in our template path, so the first request doesn't have to.
+
+        for jinja2 they are kept in our environment - and its bytecode cache on disk. for tornado
+        templates we return a loader holding them, which you can pass to your application as
+        its template_loader setting, :meth:`run` does that for you in production mode.
 
+        :param settings: template_path, autoescape and template_whitespace settings of the
+                         application are passed to tornado's loader
+        """
+        self._templates_compiled = True
+        if self.template_engine == 'jinja2':
+            for name in self.list_templates():
+                try:
+                    self.template_env.get_template(name)
+                except Exception:
+                    logger.exception("can't compile template %s", name)
+            return None
+
+        import tornado.template
+        kwargs = {}
+        if 'autoescape' in settings:
+            kwargs['autoescape'] = settings['autoescape']
+        if 'template_whitespace' in settings:
+            kwargs['whitespace'] = settings['template_whitespace']
+        template_path = settings.get('template_path') or self.template_path
+        loader = tornado.template.Loader(template_path, **kwargs)
+        for name in self.list_templates(template_path):
+            try:
+                loader.load(name)
+            except Exception:
+                logger.exception("can't compile template %s", name)
+        self.template_loader = loader
+        return loader
 
     def get_routes(self):
         """
         returns our compiled routes and classes as a list to be used in tornado
+
+        routes are compiled once and kept up to date as you add new ones, we only
+        compile them all again when debug mode changes, since it changes our handler bases.
         """
-        self.registery = OrderedDict()
-        for rule in self.methods:
-            self.route_(**rule)
-        return [(k, v) for k, v in self.registery.iteritems()]
+        self._ensure_compiled()
+        return [(k, v) for k, v in self.registery.items()]
+
+    def _ensure_compiled(self):
+        "compiles our routes again if debug mode changed, without copying them like get_routes"
+        if self._compiled_debug != self.debug:
+            self.registery = OrderedDict()
+            self.rules = {}
+            self.url_map = None
+            self.mapper = None
+            self._url_builders = {}
+            self._url_cache.clear()
+            for rule in self.methods:
+                self.route_(**rule)
+            self._compiled_debug = self.debug
+
+    def match_route(self, path):
+        """
+        returns the handler class of the first of our routes matching path, None if
+        none does. only the routes you added with :meth:`route` count.
+        """
+        self._ensure_compiled()
+        for pattern, klass in self.registery.items():
+            regex = self._route_regexes.get(pattern)
+            if regex is None:
+                # tornado matches them to the end too
+                regex = self._route_regexes[pattern] = re.compile(
+                    pattern if pattern.endswith('$') else pattern + '$')
+            if regex.match(path):
+                return klass
+        return None
+
+    def get_router(self, application):
+        """
+        returns a :class:`tornado_smack.routing.TrieRouter` for our routes, you can add it to
+        your own application like this::
+
+            from tornado.routing import AnyMatches
+
+            application = tornado.web.Application(my_handlers)
+            application.wildcard_router.add_rules([(AnyMatches(), app.get_router(application))])
+
+        :param application: the tornado application that will create the handlers
+        """
+        from .routing import TrieRouter
+        self._ensure_compiled()
+        return TrieRouter(application, [(pattern, self.rules.get(pattern), klass)
+                                        for pattern, klass in self.registery.items()])
+
+    def url_for(self, endpoint, **values):
+        """
+        builds the url of a route, endpoints are the names of your view functions::
+
+            @app.route("/articles/<int:id>")
+            def article(id):
+                ...
+
+            app.url_for('article', id=42, page=2)   # /articles/42?page=2
+
+        values that aren't arguments of the route go to the query string. it is also
+        available in templates. werkzeug style routes and plain paths can be built, we
+        remember the urls we built last, so building the same one again costs a dict lookup.
+        """
+        try:
+            key = (endpoint, tuple(sorted(values.items())))
+            return self._url_cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable values
+            key = None
+        self._ensure_compiled()
+        for arguments, build in self._url_builders.get(endpoint, ()):
+            if arguments.issubset(values):
+                built = build(values)
+                if built is not None:
+                    url = built[1]
+                    break
+        else:
+            from werkzeug.routing import BuildError
+            raise BuildError(endpoint, values, None)
+        if key is not None:
+            self._url_cache[key] = url
+        return url
+
+    def get_static_handler_class(self):
+        """
+        returns the handler class serving our static_path. out of debug mode it has
+        already hashed every file and found their compressed variants.
+        """
+        if self._static_handler_class is None or self._static_debug != self.debug:
+            from .static import make_handler_class
+            self._static_handler_class = make_handler_class(
+                self.static_path, self.static_cache_bytes, self.static_cache_file_size,
+                production=not self.debug)
+            self._static_debug = self.debug
+        return self._static_handler_class
+
+    def static_url(self, path, include_version=True):
+        """
+        the url of a file in static_path, with the hash of its content in it so browsers
+        can keep it forever. also available in templates.
+        """
+        klass = self.get_static_handler_class()
+        if self.debug:
+            # the file may have changed
+            klass.reset()
+        settings = dict(static_path=self.static_path, static_url_prefix=self.static_url_prefix)
+        return klass.make_static_url(settings, path, include_version)
 
     def is_werkzeug_route(self, route):
         """
         does it look like a werkzeug route or direct reg exp. of
         tornado.
         """
+        if '<' not in route:
+            # no variables, no need to load werkzeug.routing to know
+            return None
+        from werkzeug.routing import _rule_re
         return _rule_re.match(route)
 
-    def route(self, rule, methods=None, werkzeug_route=None, tornado_route=None, handler_bases=None, nowrap=None):
+    def route(self, rule, methods=None, werkzeug_route=None, tornado_route=None, handler_bases=None, nowrap=None,
+              cache=None, executor=None, coalesce=None, max_concurrency=None, max_queue=0,
+              timeout=None):
         """
         our super handy dandy routing function, usually you create an application,
         and decorate your functions so they become RequestHandlers::
@@ -274,6 +996,52 @@ class App(object):
 
                         will give you an error.
 
+        :param cache: a :class:`tornado_smack.cache.CachePolicy`, GET responses of this route are
+                      kept and served from there without calling your view::
+
+                            @route('/articles/<category>', cache=CachePolicy(ttl=30, vary=['page']))
+                            def articles(category):
+                                ...
+
+        :param executor: 'thread' runs your view in our thread pool - see :class:`App` - or you can pass
+                         your own concurrent.futures executor. useful for views that block, they
+                         don't hold up the other requests while they wait::
+
+                            @route('/report/<id>', executor='thread')
+                            def report(id):
+                                return render_template('report.html', rows=slow_query(id))
+
+                         handler works in the thread, but its methods are not thread safe, so
+                         leave writing the response to the return value. can't be used with
+                         async or unwrapped views.
+
+                         'process' runs it in our process pool, for cpu bound work threads can't
+                         do in parallel. only your view and its path arguments are sent to the
+                         other process, so it has to be picklable - defined at module level - and
+                         it can't use handler. its return value comes back and is handled as usual.
+
+        :param coalesce: True makes GET requests that come while the same one - same path
+                         and query string - is running wait for it and get its response,
+                         instead of calling your view again. pass a list of query argument
+                         names to only compare those, or a :class:`tornado_smack.cache.Coalescer`.
+                         your view has to give the same response to everyone asking for the
+                         same url, so don't use it for views that depend on the user.
+
+        :param max_concurrency: requests of this route running at once, the others wait in
+                                a queue of max_queue or get a 503 with a Retry-After header
+                                right away. this comes on top of the limit of the app, the
+                                current numbers are in :attr:`admission`. cache hits and
+                                coalesced requests don't count.
+
+        :param timeout: seconds your view can take, the timeout of the app by default, 0
+                        for no limit. after that we give up on it and send a 504, so a
+                        stuck upstream call doesn't hold the connection and its slot
+                        forever. the view isn't stopped, it is abandoned: what it sends
+                        later is dropped. only views returning futures - async ones,
+                        coroutines and those running in an executor - can time out.
+                        the time a request waits for a slot, see max_concurrency, counts
+                        too. timed out requests are counted in the metrics of the route.
+
         """
         def inner(fn):
             self.add_route(rule=rule,
@@ -282,26 +1050,45 @@ class App(object):
                  tornado_route=tornado_route,
                  handler_bases=handler_bases,
                  fn=fn,
-                 nowrap=nowrap)
+                 nowrap=nowrap,
+                 cache=cache,
+                 executor=executor,
+                 coalesce=coalesce,
+                 max_concurrency=max_concurrency,
+                 max_queue=max_queue,
+                 timeout=timeout)
             return fn
         return inner
 
     def add_route(self, rule, fn=None, methods=None,
                   werkzeug_route=None, tornado_route=None,
-                  handler_bases=None, nowrap=None):
+                  handler_bases=None, nowrap=None, cache=None, executor=None, coalesce=None,
+                  max_concurrency=None, max_queue=0, timeout=None):
         assert callable(fn)
-        self.methods.append(dict(
+        route = dict(
             rule=rule,
              methods=methods,
              werkzeug_route=werkzeug_route,
              tornado_route=tornado_route,
              handler_bases=handler_bases,
              fn=fn,
-             nowrap=nowrap
-        ))
+             nowrap=nowrap,
+             cache=cache,
+             executor=executor,
+             coalesce=coalesce,
+             max_concurrency=max_concurrency,
+             max_queue=max_queue,
+             timeout=timeout
+        )
+        self.methods.append(route)
+        if self._compiled_debug == self.debug:
+            # our registery is already compiled, just add this one
+            self.route_(**route)
 
     def route_(self, rule, methods=None, werkzeug_route=None,
-                    tornado_route=None, handler_bases=None, fn=None, nowrap=None):
+                    tornado_route=None, handler_bases=None, fn=None, nowrap=None,
+                    cache=None, executor=None, coalesce=None, max_concurrency=None, max_queue=0,
+                    timeout=None):
         if not methods:
             methods = ['GET']
 
@@ -314,55 +1101,124 @@ class App(object):
                 bases = (tornado.web.RequestHandler,)
         else:
             bases = (DebuggableHandler,) + handler_bases
-        m = {}
-        for method in methods:
-            inspected = inspect.getargspec(fn)
-
-            can_be_wrapped = True
-            if nowrap == None:
-                # are we using a tornado.coroutine or something similar,
-                # we dont wrap
-                if 'tornado' in inspect.getsourcefile(fn):
-                    can_be_wrapped = False
-                else:
-                    can_be_wrapped = nowrap != True
+        self_in_args, is_tornado, is_async = _inspect_view(fn)
+        can_be_wrapped = True
+        if nowrap == None:
+            # are we using a tornado.coroutine or something similar,
+            # we dont wrap
+            if is_tornado:
+                can_be_wrapped = False
             else:
-                can_be_wrapped = nowrap
+                can_be_wrapped = nowrap != True
+        else:
+            can_be_wrapped = nowrap
 
-            self_in_args = inspected.args and inspected.args[0] in ['self', 'handler']
+        app = self
+        if not self_in_args and can_be_wrapped==True:
+            if executor is not None:
+                assert not is_async, "async views can't run in an executor"
 
-            if not self_in_args and can_be_wrapped==True:
+                @gen.coroutine
                 def wrapper(self, *args, **kwargs):
-                    with StackContext(functools.partial(ctx_man, self)) as cm:
-                        w = fn #wrap(fn)
-                        result = w(*args, **kwargs)
-
-                    if isinstance(result, TemplateProxy):
-                        if self._template_engine == 'tornado':
-                            self.render(*result.args, **result.kwargs)
+                    started = _timer()
+                    pool = app.get_executor(executor)
+                    try:
+                        if executor == 'process' or _is_process_pool(pool):
+                            result = yield _submit_to_process(pool, fn, args, kwargs)
                         else:
-                            template = self._template_env.get_template(result.args[0])
-                            self.finish(template.render(handler=self, **result.kwargs))
-                    else:
-                        self.finish(result)
-
-                    # import gc
-                    # # gc.collect()
-                    # print "is gc enabled", gc.isenabled()
-                    # print "-----------------"
-                    # for obj in gc.get_objects():
-                    #     if isinstance(obj, DebuggableHandler):
-                    #         print ">>>", type(obj), "<<<"
-                    #
-                    # print "-----------------"
-
-
-                m[method.lower()] = wrapper
+                            result = yield _submit_view(self, pool, fn, args, kwargs)
+                    finally:
+                        if self._metrics is not None:
+                            self._metrics.observe_view(_timer() - started)
+                    future = _finish_result(self, result)
+                    if future is not None:
+                        yield future
+            elif is_async:
+                @gen.coroutine
+                def wrapper(self, *args, **kwargs):
+                    started = _timer()
+                    try:
+                        result = yield _run_view(self, fn, args, kwargs, is_async=True)
+                    finally:
+                        if self._metrics is not None:
+                            self._metrics.observe_view(_timer() - started)
+                    future = _finish_result(self, result)
+                    if future is not None:
+                        yield future
             else:
-                m[method.lower()] = fn
+                def wrapper(self, *args, **kwargs):
+                    metrics = self._metrics
+                    if metrics is None:
+                        return _finish_result(self, _run_view(self, fn, args, kwargs))
+                    started = _timer()
+                    try:
+                        result = _run_view(self, fn, args, kwargs)
+                    finally:
+                        metrics.observe_view(_timer() - started)
+                    return _finish_result(self, result)
+
+            method_fn = wrapper
+        else:
+            assert executor is None, "only wrapped views can run in an executor"
+            method_fn = fn
+
+        m = dict((method.lower(), method_fn) for method in methods)
+
+        # the last one wraps the others, so it is checked first. requests waiting for
+        # a slot of their route don't hold one of the app meanwhile.
+        limiters = []
+        if self.admission.app is not None:
+            limiters.append(self.admission.app)
+        if max_concurrency:
+            limiters.append(self.admission.route(rule, max_concurrency, max_queue))
+        if limiters:
+            bases = (AdmissionHandlerMixin,) + bases
+            for limiter in limiters:
+                for method in methods:
+                    m[method.lower()] = limiter.wrap(m[method.lower()])
+
+        if timeout is None:
+            timeout = self.timeout
+        if timeout:
+            # the time waiting for a slot counts too
+            for method in methods:
+                m[method.lower()] = _with_deadline(m[method.lower()], timeout)
+
+        if coalesce and 'get' in m:
+            if not isinstance(coalesce, Coalescer):
+                coalesce = Coalescer(vary=None if coalesce is True else coalesce)
+            bases = (CoalescingHandlerMixin,) + bases
+            m['get'] = coalesce.wrap(rule, m['get'])
+            m['_coalescer'] = coalesce
+
+        if cache is not None and 'get' in m:
+            bases = (CachedHandlerMixin,) + bases
+            m['get'] = cache.wrap(rule, m['get'])
+            m['_cache_policy'] = cache
+
+        if self.profiler is not None:
+            from .profiling import ProfilingHandlerMixin
+            bases = (ProfilingHandlerMixin,) + bases
+            for method in methods:
+                # profiled requests skip the cache
+                m[method.lower()] = self.profiler.wrap(rule, m[method.lower()], method_fn)
+
+        if self.template_engine == 'tornado':
+            bases = (UrlForHandlerMixin,) + bases
+
+        if self.metrics is not None:
+            bases = (MetricsHandlerMixin,) + bases
+            m['_metrics'] = self.metrics.route(rule)
+        else:
+            m['_metrics'] = None
 
         klass = type(clsname, bases, m)
         klass._template_engine = self.template_engine
+        klass._stream_chunk_size = self.stream_chunk_size
+        klass._json_encoder = staticmethod(self.json_encoder)
+        klass._url_for = staticmethod(self.url_for)
+        klass._app = self
+        klass.upstream = property(_handler_upstream)
         if self.template_engine != 'tornado':
             klass._template_env = self.template_env
 
@@ -378,44 +1234,173 @@ class App(object):
             use_werkzeug_route = self.is_werkzeug_route(rule)
 
         if use_werkzeug_route:
-            r = Rule(rule, methods=methods)
+            from werkzeug.routing import Map, Rule
+            if self.url_map is None:
+                self.url_map = Map()
+                self.mapper = self.url_map.bind("", "/")
+            r = Rule(rule, methods=methods, endpoint=fn.__name__)
             self.url_map.add(r)
-            r.compile()
+            if getattr(r, '_regex', None) is None:
+                # adding it to the map compiles it already
+                r.compile()
             pattern = r._regex.pattern.replace('^\\|', "")
             self.registery[pattern] = klass
+            self.rules[pattern] = r
+            self._url_builders.setdefault(fn.__name__, []).append((frozenset(r.arguments), r.build))
+            if self._url_cache:
+                self._url_cache.clear()
         else:
             self.registery[rule] = klass
+            self.rules.pop(rule, None)
+            if _plain_path_re.match(rule):
+                # no reg. exp. in it, it is its own url
+                self._url_builders.setdefault(fn.__name__, []).append((frozenset(), _path_builder(rule)))
+                if self._url_cache:
+                    self._url_cache.clear()
 
     def add_routes(self, routes_list):
         self.routes_list = routes_list
 
-    def run(self, port=8888, address="127.0.0.1", **settings):
+    def get_builtin_routes(self):
+        """
+        routes we serve ourselves, before yours
+        """
+        routes = []
+        if self.metrics_url is not None:
+            assert self.metrics is not None, "metrics_url needs metrics"
+            routes.append((self.metrics_url, MetricsHandler, dict(metrics=self.metrics)))
+        if self.batch_url is not None:
+            from .batch import BatchHandler
+            routes.append((self.batch_url, BatchHandler,
+                           dict(app=self, max_requests=self.batch_max_requests)))
+        return routes
+
+    def _make_application(self, application_class, **settings):
+        if self.static_path:
+            settings.setdefault('static_path', self.static_path)
+            settings.setdefault('static_url_prefix', self.static_url_prefix)
+            settings.setdefault('static_handler_class', self.get_static_handler_class())
+        builtin_routes = self.get_builtin_routes()
+        if self.dispatcher == 'trie':
+            from tornado.routing import AnyMatches
+            application = application_class(**settings)
+            application.wildcard_router.add_rules(
+                builtin_routes + [(AnyMatches(), self.get_router(application))] + self.routes_list)
+            return application
+        return application_class(builtin_routes + self.get_routes() + self.routes_list, **settings)
+
+    def make_application(self, **settings):
+        """
+        returns the tornado Application serving our routes, settings are passed to it.
+        in debug mode it is a DebugApplication with werkzeug's debugger.
+        """
         self.debug = settings.get('debug', False)
         template_path = settings.get('template_path')
         if not template_path:
             settings['template_path'] = self.template_path
-        if self.debug:
-            if with_wsgi_adapter:
-                import tornado.httpserver
-                from werkzeug.debug import DebuggedApplication
-                application = DebugApplication(self.get_routes() + self.routes_list, **settings)
-                wsgi_application = tornado.wsgi.WSGIAdapter(application)
-
-                debug_app = DebuggedApplication(app=wsgi_application, evalex=True)
-                application.debug_app = debug_app
-                debug_container = tornado.wsgi.WSGIContainer(debug_app)
-
-                http_server = tornado.httpserver.HTTPServer(debug_container)
-                http_server.listen(8888)
-                tornado.ioloop.IOLoop.instance().start()
-            else:
-                import tornado.ioloop
-                application = DebugApplication(self.get_routes() + self.routes_list, **settings)
-                application.listen(port, address)
-                tornado.ioloop.IOLoop.instance().start()
+        if self.template_mode == 'production':
+            if not self._templates_compiled:
+                self.precompile_templates(**settings)
+            if self.template_loader is not None:
+                settings.setdefault('template_loader', self.template_loader)
+            # even in debug mode, we don't want tornado to reset its loader
+            settings['compiled_template_cache'] = True
+        if not self.debug:
+            return self._make_application(tornado.web.Application, **settings)
+        application = self._make_application(DebugApplication, **settings)
+        if with_wsgi_adapter:
+            from tornado.wsgi import WSGIAdapter
+            from werkzeug.debug import DebuggedApplication
+            application.set_debug_app(DebuggedApplication(app=WSGIAdapter(application), evalex=True))
+        return application
+
+    def make_server(self, **settings):
+        """
+        returns a tornado HTTPServer serving our application, with the werkzeug
+        debugger in front of it if debug is set. you still have to add sockets to it.
+        """
+        from .server import HTTPServer
+        application = self.make_application(**settings)
+        if self.debug and with_wsgi_adapter:
+            from tornado.wsgi import WSGIContainer
+            # the debugger answers its own requests and passes the others to our application
+            return HTTPServer(WSGIContainer(application.debug_app))
+        return HTTPServer(application)
+
+    def test_client(self, **settings):
+        """
+        returns a :class:`tornado_smack.inprocess.Client` sending requests straight into
+        our application, without sockets, servers or other processes::
+
+            client = app.test_client()
+            assert client.get('/articles/1').code == 200
+
+        settings are passed to the application like in :meth:`run`.
+        """
+        from .inprocess import Client
+        # it would restart the tests when a file changes
+        settings.setdefault('autoreload', False)
+        return Client(self.make_application(**settings))
+
+    def run(self, port=8888, address="127.0.0.1", processes=1, reuse_port=False, drain_timeout=30,
+            reload=False, **settings):
+        """
+        starts serving our routes, settings are passed to tornado.web.Application
+
+        SIGTERM or SIGINT stop us gracefully: we stop accepting connections and wait for
+        the requests in flight, drain_timeout seconds at most, then run returns. a second
+        signal stops us right away.
+
+        :param processes: forks this many worker processes, None or 0 forks one per cpu.
+                          workers that die are started again, SIGTERM or SIGINT stops them all.
+                          you can't use it with debug mode, the debugger keeps its state in
+                          one process.
+        :param reuse_port: if we fork, each worker binds its own socket with SO_REUSEPORT
+                           and the kernel balances connections between them, otherwise they
+                           all accept from one socket we bind before forking.
+        :param drain_timeout: seconds we wait for requests in flight when stopping
+        :param reload: SIGHUP starts a fresh copy of the program - same command line - which
+                       takes over our listening sockets, and we stop gracefully once it is
+                       serving. so new code and templates are loaded without refusing
+                       connections. the new process isn't our child, tell your process
+                       manager to follow it. with reuse_port the new workers bind their
+                       own sockets instead, and we stop once all of them are serving.
+        """
+        import signal
+        from tornado.netutil import bind_sockets
+        from .process import inherited_sockets, notify_ready
+        from .server import Lifecycle
+        # the ones of the process we replace, if we are reloading
+        sockets = inherited_sockets()
+        if processes == 1:
+            if sockets is None:
+                sockets = bind_sockets(port, address)
         else:
-            import tornado.web
-            application = tornado.web.Application(self.get_routes() + self.routes_list, **settings)
-            logger.info("starting server on port: %s", port)
-            application.listen(port, address)
-            tornado.ioloop.IOLoop.instance().start()
+            from .process import Supervisor
+            assert not settings.get('debug'), "debug mode can't run in multiple processes"
+            if self.template_mode == 'production':
+                # compile them once, workers share them
+                settings.setdefault('template_path', self.template_path)
+                self.precompile_templates(**settings)
+            if reuse_port:
+                sockets = None
+            elif sockets is None:
+                sockets = bind_sockets(port, address)
+            # tells the process we replace that we are ready once the workers are serving,
+            # only workers return from here, the parent waits for them and exits
+            supervisor = Supervisor(processes, reload_signal=signal.SIGHUP if reload else None,
+                                    sockets=sockets, workers_report=reuse_port)
+            supervisor.start()
+            if reuse_port:
+                sockets = bind_sockets(port, address, reuse_port=True)
+        http_server = self.make_server(**settings)
+        http_server.add_sockets(sockets)
+        lifecycle = Lifecycle(http_server, sockets, drain_timeout,
+                              reload_signal=signal.SIGHUP if reload and processes == 1 else None)
+        lifecycle.install()
+        if processes == 1:
+            notify_ready()
+        elif reuse_port:
+            supervisor.worker_ready()
+        logger.info("starting server on port: %s", port)
+        tornado.ioloop.IOLoop.instance().start()
@@ -0,0 +1,107 @@
+"""
+    smack.batch
+    ~~~~~~~~~~~
+
+    many requests in one round trip::
+
+        app = App(batch_url='/_batch')
+
+    POST a list of sub-requests to it::
+
+        {"requests": [{"path": "/articles/1"},
+                      {"path": "/users/me", "headers": {"Accept-Language": "tr"}}]}
+
+    and get their responses back in the same order::
+
+        {"responses": [{"status": 200, "headers": {...}, "body": "..."}, ...]}
+
+    sub-requests run concurrently in this process, through our routes, without
+    sockets. they get the headers of the batch request - cookies, authorization -
+    along with their own. paths that aren't one of our routes get a 404, and only
+    GET and HEAD can be batched, so a batch never changes anything half way.
+"""
+
+import json
+import tornado.web
+from tornado import gen
+from tornado.escape import native_str
+from tornado.httputil import HTTPHeaders
+from tornado.iostream import StreamClosedError
+from .inprocess import fetch, Context
+
+try:
+    string_types = (str, unicode)
+except NameError:
+    # python 3
+    string_types = (str,)
+
+
+def _result(status, body, headers=None):
+    return dict(status=status, headers=headers or {}, body=body)
+
+
+class BatchHandler(tornado.web.RequestHandler):
+
+    methods = ('GET', 'HEAD')
+    # headers of the batch request its sub-requests don't get
+    skipped_headers = frozenset(['Content-Length', 'Content-Type', 'Transfer-Encoding',
+                                 'Accept-Encoding', 'Expect'])
+
+    def initialize(self, app, max_requests=50):
+        self.app = app
+        self.max_requests = max_requests
+
+    @gen.coroutine
+    def post(self):
+        try:
+            batch = json.loads(self.request.body.decode('utf-8'))
+        except ValueError:
+            raise tornado.web.HTTPError(400, 'the body is not json')
+        if isinstance(batch, dict):
+            batch = batch.get('requests')
+        if not isinstance(batch, list):
+            raise tornado.web.HTTPError(400, 'no list of requests')
+        if len(batch) > self.max_requests:
+            raise tornado.web.HTTPError(400, 'more than %d requests' % self.max_requests)
+        headers = HTTPHeaders()
+        for name, value in self.request.headers.get_all():
+            if name not in self.skipped_headers:
+                headers.add(name, value)
+        responses = yield [self.run(sub_request, headers) for sub_request in batch]
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.finish(self.app.json_encoder({'responses': responses}))
+
+    @gen.coroutine
+    def run(self, sub_request, batch_headers):
+        "returns the result of one sub-request, as a dict"
+        if not isinstance(sub_request, dict):
+            raise gen.Return(_result(400, 'not an object'))
+        path = sub_request.get('path')
+        if not isinstance(path, string_types) or not path.startswith('/'):
+            raise gen.Return(_result(400, 'no path'))
+        method = sub_request.get('method', 'GET')
+        if not isinstance(method, string_types):
+            raise gen.Return(_result(400, 'method is not a string'))
+        method = method.upper()
+        if method not in self.methods:
+            raise gen.Return(_result(405, '%s requests can not be batched' % method))
+        sub_headers = sub_request.get('headers') or {}
+        if not isinstance(sub_headers, dict) or not all(
+                isinstance(value, string_types) for value in sub_headers.values()):
+            raise gen.Return(_result(400, 'headers is not an object of strings'))
+        if self.app.match_route(path.split('?', 1)[0]) is None:
+            raise gen.Return(_result(404, 'no route for %s' % path))
+        headers = HTTPHeaders()
+        for name, value in batch_headers.get_all():
+            headers.add(name, value)
+        for name, value in sub_headers.items():
+            headers[name] = value
+        try:
+            response = yield fetch(self.application, method, native_str(path), headers,
+                                   context=Context(self.request.remote_ip,
+                                                   self.request.protocol))
+        except StreamClosedError:
+            # it timed out half way through its response
+            raise gen.Return(_result(504, 'the response was cut off'))
+        raise gen.Return(_result(response.code, response.body.decode('utf-8', 'replace'),
+                                 dict(response.headers.items())))
@@ -0,0 +1,297 @@
+"""
+    smack.cache
+    ~~~~~~~~~~~
+
+    per route response caching::
+
+        from tornado_smack import App, CachePolicy
+
+        app = App()
+        articles = CachePolicy(ttl=30, max_entries=1000, vary=['page'])
+
+        @app.route("/articles/<category>", cache=articles)
+        def list_articles(category):
+            ...
+
+        # later, when something changes
+        articles.invalidate(category='news')
+
+    and single-flight requests, concurrent GETs of the same url share one call
+    of the view::
+
+        @app.route("/foobar/<id>", coalesce=True)
+        def foobar(id):
+            ...
+"""
+
+import time
+from tornado import gen
+from tornado.concurrent import Future
+from .lru import LRUDict
+
+_now = getattr(time, 'monotonic', time.time)
+
+try:
+    string_types = (str, unicode)
+except NameError:
+    # python 3
+    string_types = (str,)
+
+# these are set again by tornado for every response
+_skipped_headers = frozenset(['Content-Length', 'Transfer-Encoding', 'Date', 'Server'])
+
+
+class RecordedResponse(object):
+    __slots__ = ('status', 'reason', 'headers', 'body')
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+def _path_value(value):
+    "path arguments are strings, whatever their converter is"
+    return value if isinstance(value, string_types) else str(value)
+
+
+def _sets_cookies(response):
+    for name, value in response.headers:
+        if name == 'Set-Cookie':
+            return True
+    return False
+
+
+class RecordingHandlerMixin(object):
+    """
+    records what the handler sends after start_recording() is called, so we can
+    send the same response again with replay()
+    """
+    _recording = None
+    _recorded_status = None
+
+    def start_recording(self):
+        self._recording = []
+
+    def flush(self, include_footers=False, *args, **kwargs):
+        if self._recording is not None:
+            if not self._headers_written:
+                headers = list(self._headers.get_all())
+                # tornado adds cookies to the headers while flushing
+                for cookie in getattr(self, '_new_cookie', {}).values():
+                    headers.append(('Set-Cookie', cookie.OutputString(None)))
+                self._recorded_status = (self._status_code, self._reason, headers)
+            self._recording.extend(self._write_buffer)
+        return super(RecordingHandlerMixin, self).flush(include_footers, *args, **kwargs)
+
+    def recorded_response(self):
+        """
+        returns a RecordedResponse, or None if we didn't record anything
+        """
+        if self._recorded_status is None:
+            return None
+        status, reason, headers = self._recorded_status
+        return RecordedResponse(status, reason, headers, b''.join(self._recording))
+
+    def replay(self, response):
+        self.set_status(response.status, response.reason)
+        seen = set()
+        for name, value in response.headers:
+            if name in _skipped_headers:
+                continue
+            if name in seen:
+                self.add_header(name, value)
+            else:
+                self.set_header(name, value)
+                seen.add(name)
+        if response.status == 200 and self.check_etag_header():
+            # tornado only compares the etags it computes itself
+            self.set_status(304)
+            self.finish()
+            return
+        self.finish(response.body)
+
+
+class CachedHandlerMixin(RecordingHandlerMixin):
+    _cache_key = None
+
+    def on_finish(self):
+        if self._cache_key is not None:
+            response = self.recorded_response()
+            if response is not None:
+                self._cache_policy.store(self._cache_key, response)
+        super(CachedHandlerMixin, self).on_finish()
+
+
+class CachePolicy(object):
+    """
+    caches the responses of GET requests of the routes it is given to. the cache key is
+    made of the route, its path arguments and the query arguments and request headers
+    we vary on, any other query argument is ignored. only 200 responses without cookies
+    are stored.
+
+    one policy can be shared by many routes, they share its max_entries too.
+
+    :param ttl: seconds a response is served from the cache
+    :param max_entries: number of responses we keep, least recently used ones are dropped first
+    :param vary: names of the query arguments that change the response
+    :param vary_headers: names of the request headers that change the response
+    """
+    def __init__(self, ttl=60, max_entries=1000, vary=(), vary_headers=()):
+        self.ttl = ttl
+        self.vary = tuple(vary)
+        self.vary_headers = tuple(vary_headers)
+        self.entries = LRUDict(max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def key(self, route, handler, args, kwargs):
+        request = handler.request
+        return (route, tuple(args), tuple(sorted(kwargs.items())),
+                tuple(tuple(request.query_arguments.get(name, ())) for name in self.vary),
+                tuple(request.headers.get(name) for name in self.vary_headers))
+
+    def get(self, key):
+        """
+        returns the cached RecordedResponse for key, or None
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires, response = entry
+        if expires < _now():
+            del self.entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return response
+
+    def store(self, key, response):
+        if response.status != 200 or _sets_cookies(response):
+            return
+        self.entries[key] = (_now() + self.ttl, response)
+
+    def invalidate(self, *args, **kwargs):
+        """
+        drops the cached responses with these path arguments, for every route and
+        query argument. without arguments drops everything. values are compared as
+        strings, so invalidate(id=42) drops /articles/42.
+        """
+        if not args and not kwargs:
+            return self.clear()
+        args = tuple(_path_value(value) for value in args)
+        kwargs = tuple(sorted((name, _path_value(value)) for name, value in kwargs.items()))
+        for key in [key for key in self.entries if key[1] == args and key[2] == kwargs]:
+            del self.entries[key]
+
+    def clear(self):
+        for key in list(self.entries):
+            del self.entries[key]
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, expired=self.expired,
+                    evictions=self.entries.evictions, entries=len(self.entries))
+
+    def wrap(self, route, method):
+        """
+        returns a handler method that serves from the cache, or calls method and
+        records its response
+        """
+        policy = self
+
+        def cached(self, *args, **kwargs):
+            key = policy.key(route, self, args, kwargs)
+            response = policy.get(key)
+            if response is not None:
+                self.replay(response)
+                return None
+            self._cache_key = key
+            self.start_recording()
+            return method(self, *args, **kwargs)
+        return cached
+
+
+class CoalescingHandlerMixin(RecordingHandlerMixin):
+    _coalesce_key = None
+
+    def on_finish(self):
+        if self._coalesce_key is not None:
+            self._coalescer.done(self._coalesce_key, self.recorded_response())
+        super(CoalescingHandlerMixin, self).on_finish()
+
+
+class Coalescer(object):
+    """
+    while a GET request of a route is running, the same requests wait for it and get a
+    copy of its response, whatever its status, instead of calling the view again.
+    304s and responses setting cookies aren't shared, the requests waiting for them
+    call the view themselves.
+
+    :param vary: names of the query arguments that change the response, None to
+                 compare the whole query string
+    :param vary_headers: names of the request headers that change the response
+    """
+    def __init__(self, vary=None, vary_headers=()):
+        self.vary = None if vary is None else tuple(vary)
+        self.vary_headers = tuple(vary_headers)
+        # key -> future of the response
+        self.in_flight = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def key(self, route, handler, args, kwargs):
+        request = handler.request
+        if self.vary is None:
+            query = request.query
+        else:
+            query = tuple(tuple(request.query_arguments.get(name, ())) for name in self.vary)
+        return (route, request.method, tuple(args), tuple(sorted(kwargs.items())), query,
+                tuple(request.headers.get(name) for name in self.vary_headers))
+
+    def done(self, key, response):
+        future = self.in_flight.pop(key, None)
+        if future is not None:
+            if response is not None and (response.status == 304 or _sets_cookies(response)):
+                # a 304 answers the If-None-Match of one client and cookies are for one
+                # client, the others call the view themselves
+                response = None
+            future.set_result(response)
+
+    def stats(self):
+        return dict(executions=self.executions, coalesced=self.coalesced,
+                    in_flight=len(self.in_flight))
+
+    @gen.coroutine
+    def wait(self, handler, future, method, args, kwargs):
+        response = yield future
+        if response is None:
+            # it didn't send anything we can send again
+            result = method(handler, *args, **kwargs)
+            if result is not None:
+                yield result
+        else:
+            handler.replay(response)
+
+    def wrap(self, route, method):
+        """
+        returns a handler method that waits for the same request if it is running,
+        or calls method and records its response for the ones that come meanwhile
+        """
+        coalescer = self
+
+        def coalesced(self, *args, **kwargs):
+            key = coalescer.key(route, self, args, kwargs)
+            future = coalescer.in_flight.get(key)
+            if future is not None:
+                coalescer.coalesced += 1
+                return coalescer.wait(self, future, method, args, kwargs)
+            coalescer.in_flight[key] = Future()
+            coalescer.executions += 1
+            self._coalesce_key = key
+            self.start_recording()
+            return method(self, *args, **kwargs)
+        return coalesced
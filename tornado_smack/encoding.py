@@ -0,0 +1,82 @@
+"""
+    smack.encoding
+    ~~~~~~~~~~~~~~
+
+    json encoders for the dicts, lists and dataclasses returned by views.
+
+    every encoder takes a value and returns str or bytes, escaping "</" like
+    tornado.escape.json_encode does, so the output is safe to embed in html.
+"""
+
+import json
+
+try:
+    import dataclasses
+except ImportError:
+    # python < 3.7
+    dataclasses = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+    # default= needs ujson >= 5
+    ujson.dumps({}, default=str)
+except (ImportError, TypeError):
+    ujson = None
+
+
+def is_dataclass_instance(value):
+    return hasattr(type(value), '__dataclass_fields__')
+
+
+def _default(value):
+    if dataclasses is not None and is_dataclass_instance(value):
+        return dataclasses.asdict(value)
+    raise TypeError("%r is not JSON serializable" % (value,))
+
+
+_stdlib_encoder = json.JSONEncoder(default=_default)
+
+def tornado_encoder(value):
+    "the stdlib json module, same output as tornado.escape.json_encode"
+    return _stdlib_encoder.encode(value).replace("</", "<\\/")
+
+
+def orjson_encoder(value):
+    # like the stdlib, we turn int keys etc. into strings
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).replace(b"</", b"<\\/")
+
+
+def ujson_encoder(value):
+    # ujson escapes slashes already
+    return ujson.dumps(value, default=_default)
+
+
+encoders = {'tornado': tornado_encoder}
+if orjson is not None:
+    encoders['orjson'] = orjson_encoder
+if ujson is not None:
+    encoders['ujson'] = ujson_encoder
+
+
+def get_json_encoder(encoder='auto'):
+    """
+    returns an encoder function
+
+    :param encoder: 'auto' picks the fastest one installed - orjson, then ujson, then the
+                    stdlib -, 'tornado', 'orjson' or 'ujson' picks that one, or you can
+                    pass your own function.
+    """
+    if callable(encoder):
+        return encoder
+    if encoder == 'auto':
+        for name in ('orjson', 'ujson', 'tornado'):
+            if name in encoders:
+                return encoders[name]
+    if encoder not in encoders:
+        raise ValueError("json encoder %s is not installed" % encoder)
+    return encoders[encoder]
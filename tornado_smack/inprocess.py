@@ -0,0 +1,208 @@
+"""
+    smack.inprocess
+    ~~~~~~~~~~~~~~~
+
+    sends requests straight into a tornado application, without sockets or http
+    parsing, and keeps the responses in memory::
+
+        response = yield fetch(application, 'GET', '/articles/1')
+        response.code, response.headers, response.body
+
+    the request goes through the routes, handlers and transforms of the application
+    like any other, only the connection is ours. :class:`Client` does the same
+    without an ioloop running, it is what :meth:`tornado_smack.app.App.test_client`
+    returns.
+"""
+
+import json
+import tornado.ioloop
+from tornado.concurrent import Future
+from tornado.httputil import HTTPServerRequest, HTTPHeaders
+from tornado.iostream import StreamClosedError
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    # python 2
+    from urllib import urlencode
+
+
+def _done(callback=None):
+    if callback is not None:
+        callback()
+    future = Future()
+    future.set_result(None)
+    return future
+
+
+def _closed():
+    future = Future()
+    future.set_exception(StreamClosedError())
+    # nobody has to look at it
+    future.exception()
+    return future
+
+
+class Context(object):
+    "what tornado knows about the client of a connection"
+    def __init__(self, remote_ip='127.0.0.1', protocol='http'):
+        self.remote_ip = remote_ip
+        self.protocol = protocol
+
+
+class Response(object):
+    __slots__ = ('code', 'reason', 'headers', 'body')
+
+    def __init__(self, code, reason, headers, body):
+        self.code = code
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body.decode('utf-8'))
+
+    def __repr__(self):
+        return '<Response %s %d bytes>' % (self.code, len(self.body))
+
+
+class Connection(object):
+    """
+    stands in for the HTTP connection of a request, finished is a future
+    for the Response. it fails with StreamClosedError if the handler closes us
+    before finishing the response.
+    """
+    def __init__(self, context=None):
+        self.context = context or Context()
+        self.start_line = None
+        self.headers = None
+        self.chunks = []
+        self.finished = Future()
+
+    def set_close_callback(self, callback):
+        pass
+
+    def detach(self):
+        raise NotImplementedError("in-process requests have no stream")
+
+    def write_headers(self, start_line, headers, chunk=None, callback=None):
+        if self.finished.done():
+            return _closed()
+        self.start_line = start_line
+        self.headers = headers
+        if chunk:
+            self.chunks.append(chunk)
+        return _done(callback)
+
+    def write(self, chunk, callback=None):
+        if self.finished.done():
+            return _closed()
+        self.chunks.append(chunk)
+        return _done(callback)
+
+    def close(self):
+        if not self.finished.done():
+            self.finished.set_exception(StreamClosedError())
+
+    def finish(self):
+        if self.finished.done():
+            return
+        start_line = self.start_line
+        self.finished.set_result(Response(start_line.code, start_line.reason,
+                                          self.headers, b''.join(self.chunks)))
+
+
+def make_request(method, uri, headers=None, body=None, context=None):
+    """
+    returns an HTTPServerRequest on a :class:`Connection` of ours, a dict body
+    is sent as a form
+    """
+    if not isinstance(headers, HTTPHeaders):
+        headers = HTTPHeaders(headers or {})
+    # HTTP/1.1 requests must have one
+    headers.setdefault('Host', 'localhost')
+    if isinstance(body, dict):
+        body = urlencode(body)
+        headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+    if body is None:
+        body = b''
+    elif not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    if body and 'Content-Length' not in headers:
+        headers['Content-Length'] = str(len(body))
+    request = HTTPServerRequest(method=method, uri=uri, version='HTTP/1.1', headers=headers,
+                                body=body, connection=Connection(context))
+    # done by tornado once it has read the body
+    request._parse_body()
+    return request
+
+
+def fetch(application, method, uri, headers=None, body=None, context=None):
+    """
+    runs a request through application, returns a future for its :class:`Response`
+    """
+    request = make_request(method, uri, headers, body, context)
+    application(request)
+    return request.connection.finished
+
+
+class Client(object):
+    """
+    sends requests to a tornado application and waits for their responses::
+
+        client = Client(application, headers={'Cookie': 'session=1'})
+        response = client.get('/articles/1')
+        response.code, response.headers, response.body
+
+    each call runs an ioloop of the client until its response is finished. it is
+    only the current ioloop during the call, so processes forked later don't share
+    it. inside a coroutine, on a running ioloop, yield client.fetch(...) instead.
+
+    :param headers: sent with every request, along with their own
+    :param context: remote_ip and protocol of the requests
+    :param timeout: seconds we wait for a response, None to wait for ever
+    """
+    def __init__(self, application, headers=None, context=None, timeout=None):
+        self.application = application
+        self.headers = headers or {}
+        self.context = context
+        self.timeout = timeout
+        self.io_loop = None
+
+    def fetch(self, method, uri, headers=None, body=None):
+        "returns a future for the :class:`Response`"
+        all_headers = HTTPHeaders(self.headers)
+        if headers:
+            all_headers.update(headers)
+        return fetch(self.application, method, uri, all_headers, body, self.context)
+
+    def request(self, method, uri, headers=None, body=None):
+        "returns the :class:`Response`"
+        if self.io_loop is None:
+            self.io_loop = tornado.ioloop.IOLoop(make_current=False)
+        return self.io_loop.run_sync(lambda: self.fetch(method, uri, headers, body),
+                                     self.timeout)
+
+    def close(self):
+        "closes our ioloop"
+        if self.io_loop is not None:
+            self.io_loop.close()
+            self.io_loop = None
+
+    def get(self, uri, headers=None):
+        return self.request('GET', uri, headers)
+
+    def head(self, uri, headers=None):
+        return self.request('HEAD', uri, headers)
+
+    def delete(self, uri, headers=None):
+        return self.request('DELETE', uri, headers)
+
+    def post(self, uri, body=None, headers=None):
+        return self.request('POST', uri, headers, body)
+
+    def put(self, uri, body=None, headers=None):
+        return self.request('PUT', uri, headers, body)
+
+    def patch(self, uri, body=None, headers=None):
+        return self.request('PATCH', uri, headers, body)
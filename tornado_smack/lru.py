@@ -0,0 +1,88 @@
+"""
+    smack.lru
+    ~~~~~~~~~
+
+    a dict that forgets its least recently used items.
+"""
+
+from collections import OrderedDict
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    # python 2
+    from collections import MutableMapping
+
+
+class LRUDict(MutableMapping):
+    """
+    keeps at most max_entries items, and roughly max_bytes bytes of them as
+    measured by sizeof. reading an item makes it the most recently used one,
+    when we are over a limit we drop the least recently used ones::
+
+        tracebacks = LRUDict(max_entries=100, max_bytes=10 * 1024 * 1024, sizeof=len)
+
+    the item we have just set is never dropped, even if it is bigger than max_bytes alone.
+
+    :param max_entries: maximum number of items, None for no limit
+    :param max_bytes: maximum total size of items, None for no limit
+    :param sizeof: returns the approximate size of a value in bytes, only needed for max_bytes
+    """
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=None):
+        assert max_bytes is None or sizeof is not None
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        # key -> (value, size)
+        self._items = OrderedDict()
+
+    def __getitem__(self, key):
+        value, size = self._items.pop(key)
+        self._items[key] = (value, size)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self._items:
+            del self[key]
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        self._items[key] = (value, size)
+        self.bytes += size
+        self.evict()
+
+    def __delitem__(self, key):
+        value, size = self._items.pop(key)
+        self.bytes -= size
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        # doesn't count as a use
+        return key in self._items
+
+    def peek(self, key, default=None):
+        """
+        returns the value without making it recently used
+        """
+        try:
+            return self._items[key][0]
+        except KeyError:
+            return default
+
+    def evict(self):
+        while len(self._items) > 1 and (
+                (self.max_entries is not None and len(self._items) > self.max_entries) or
+                (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            key, (value, size) = self._items.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+            self.evicted_bytes += size
+
+    def stats(self):
+        return dict(entries=len(self._items), bytes=self.bytes,
+                    evictions=self.evictions, evicted_bytes=self.evicted_bytes)
@@ -0,0 +1,157 @@
+"""
+    smack.metrics
+    ~~~~~~~~~~~~~
+
+    request counts, status codes and latency histograms per route, in the
+    prometheus text format::
+
+        app = App(metrics_url='/metrics')
+
+    every request is recorded on the ioloop thread, so there are no locks, and
+    histograms have their buckets allocated up front, recording one is a bisect
+    and a few additions.
+"""
+
+import time
+from bisect import bisect_left
+import tornado.web
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# request is the whole request as tornado sees it, the others are parts of it
+PHASES = ('request', 'view', 'template', 'serialization')
+
+
+class Histogram(object):
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = tuple(bounds)
+        # the last one is +Inf
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+class RouteMetrics(object):
+    """
+    what we know about the requests of one route
+    """
+    def __init__(self, route, buckets=DEFAULT_BUCKETS):
+        self.route = route
+        self.statuses = {}
+        # requests we gave up on, see the timeout parameter of App.route
+        self.timeouts = 0
+        self.histograms = dict((phase, Histogram(buckets)) for phase in PHASES)
+        # bound methods, so recording a phase doesn't look them up every time
+        self.observe_view = self.histograms['view'].observe
+        self.observe_template = self.histograms['template'].observe
+        self.observe_serialization = self.histograms['serialization'].observe
+        self._observe_request = self.histograms['request'].observe
+
+    @property
+    def requests(self):
+        return sum(self.statuses.values())
+
+    def finished(self, status, request_time):
+        statuses = self.statuses
+        statuses[status] = statuses.get(status, 0) + 1
+        self._observe_request(request_time)
+
+
+class MetricsHandlerMixin(object):
+    """
+    records the status and duration of every request in the RouteMetrics of the handler
+    """
+    _metrics = None
+
+    def on_finish(self):
+        self._metrics.finished(self.get_status(), self.request.request_time())
+        super(MetricsHandlerMixin, self).on_finish()
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def histogram_lines(name, labels, histogram):
+    "prometheus lines of a histogram, labels is a string like 'route=\"/\"'"
+    lines = []
+    bounds = [repr(float(bound)) for bound in histogram.bounds] + ['+Inf']
+    for bound, count in zip(bounds, histogram.cumulative_counts()):
+        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, count))
+    lines.append('%s_sum{%s} %r' % (name, labels, histogram.sum))
+    lines.append('%s_count{%s} %d' % (name, labels, histogram.count))
+    return lines
+
+
+class Metrics(object):
+    """
+    the RouteMetrics of an app, by route
+
+    :param buckets: upper bounds of the histogram buckets, in seconds
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.routes = {}
+        # other things with a render() returning lines we serve along with ours
+        self.collectors = []
+
+    def route(self, route):
+        "returns the RouteMetrics for route, routes with the same rule share them"
+        if route not in self.routes:
+            self.routes[route] = RouteMetrics(route, self.buckets)
+        return self.routes[route]
+
+    def render(self):
+        "everything we have in the prometheus text format"
+        lines = ['# HELP smack_requests_total Requests served, by route and status code.',
+                 '# TYPE smack_requests_total counter']
+        routes = sorted(self.routes.items())
+        for route, metrics in routes:
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append('smack_requests_total{route="%s",status="%d"} %d' % (
+                    escape_label(route), status, count))
+        lines.append('# HELP smack_timeouts_total Requests whose view took longer than the '
+                     'timeout of their route.')
+        lines.append('# TYPE smack_timeouts_total counter')
+        for route, metrics in routes:
+            if metrics.timeouts:
+                lines.append('smack_timeouts_total{route="%s"} %d' % (escape_label(route),
+                                                                     metrics.timeouts))
+        lines.append('# HELP smack_request_duration_seconds Time spent on requests, by route '
+                     'and phase.')
+        lines.append('# TYPE smack_request_duration_seconds histogram')
+        for route, metrics in routes:
+            for phase in PHASES:
+                histogram = metrics.histograms[phase]
+                labels = 'route="%s",phase="%s"' % (escape_label(route), phase)
+                lines.extend(histogram_lines('smack_request_duration_seconds', labels, histogram))
+        for collector in self.collectors:
+            lines.extend(collector.render())
+        lines.append('')
+        return '\n'.join(lines)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+
+    def initialize(self, metrics):
+        self.metrics = metrics
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.finish(self.metrics.render())
@@ -0,0 +1,395 @@
+"""
+    smack.process
+    ~~~~~~~~~~~~~
+
+    forks and supervises worker processes for :meth:`tornado_smack.app.App.run`,
+    much like :func:`tornado.process.fork_processes` but it also passes shutdown
+    signals to the workers and doesn't restart the ones we stopped.
+
+    it also starts the process that replaces us on reload: a fresh copy of the
+    program, which gets our listening sockets and tells us when it is serving,
+    so no connection is refused meanwhile.
+"""
+
+import os
+import sys
+import errno
+import fcntl
+import random
+import select
+import signal
+import socket
+import logging
+import time
+import subprocess
+from binascii import hexlify
+from tornado.process import cpu_count
+
+logger = logging.getLogger(__name__)
+
+# fd:family of the listening sockets we hand over, and the pipe the new process
+# tells us it is ready on
+LISTEN_FDS_ENV = 'SMACK_LISTEN_FDS'
+READY_FD_ENV = 'SMACK_READY_FD'
+
+
+def inherited_sockets():
+    """
+    returns the listening sockets the process we replace handed us, None if
+    we weren't started by a reload
+    """
+    fds = os.environ.pop(LISTEN_FDS_ENV, None)
+    if not fds:
+        return None
+    sockets = []
+    for item in fds.split(','):
+        fd, family = [int(value) for value in item.split(':')]
+        # fromfd dups it
+        sock = socket.fromfd(fd, family, socket.SOCK_STREAM)
+        os.close(fd)
+        sock.setblocking(0)
+        sockets.append(sock)
+    return sockets
+
+
+def notify_ready():
+    "tells the process we replace that we are serving, so it can stop"
+    fd = os.environ.pop(READY_FD_ENV, None)
+    if fd is None:
+        return
+    try:
+        os.write(int(fd), b'1')
+    except OSError as e:
+        logger.warning("can't tell the old process we are ready: %s", e)
+    finally:
+        os.close(int(fd))
+
+
+def _keep_open(fds):
+    "for python 2, which can't pass some fds to a child and close the others"
+    def preexec():
+        try:
+            max_fd = os.sysconf('SC_OPEN_MAX')
+        except (AttributeError, ValueError):
+            max_fd = 256
+        low = 3
+        for fd in sorted(fds):
+            os.closerange(low, fd)
+            low = fd + 1
+        os.closerange(low, max_fd)
+    return preexec
+
+
+def _command_line():
+    "the command line we were started with"
+    orig_argv = getattr(sys, 'orig_argv', None)
+    if orig_argv:
+        # python 3.10+ keeps the interpreter options and -m
+        return [sys.executable] + orig_argv[1:]
+    spec = getattr(sys.modules['__main__'], '__spec__', None)
+    if spec is not None and spec.name:
+        # started with python -m, sys.argv[0] is the path of its __main__
+        name = spec.name
+        if name.endswith('.__main__'):
+            name = name[:-len('.__main__')]
+        return [sys.executable, '-m', name] + sys.argv[1:]
+    return [sys.executable] + sys.argv
+
+
+def start_successor(sockets, argv=None):
+    """
+    starts a fresh copy of our program - argv, the command line we were started with
+    by default - handing it sockets. returns the read end of a pipe it writes to when
+    it is ready, or closes if it dies before.
+    """
+    argv = argv or _command_line()
+    sockets = sockets or []
+    read_fd, write_fd = os.pipe()
+    fds = [sock.fileno() for sock in sockets] + [write_fd]
+    for fd in fds:
+        # tornado makes the listening sockets close on exec
+        fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) & ~fcntl.FD_CLOEXEC)
+    env = dict(os.environ)
+    env[READY_FD_ENV] = str(write_fd)
+    if sockets:
+        env[LISTEN_FDS_ENV] = ','.join('%d:%d' % (sock.fileno(), sock.family) for sock in sockets)
+    if sys.version_info >= (3, 2):
+        kwargs = dict(pass_fds=fds)
+    else:
+        kwargs = dict(close_fds=False, preexec_fn=_keep_open(fds))
+    try:
+        process = subprocess.Popen(argv, env=env, **kwargs)
+    finally:
+        os.close(write_fd)
+    logger.info("started pid %d to replace us", process.pid)
+    return read_fd
+
+
+class Supervisor(object):
+    """
+    usage::
+
+        sockets = bind_sockets(8888)
+        worker_id = Supervisor(4).start()
+        # we are in a worker from now on, the parent never returns from start()
+
+    :param num_processes: number of workers, None or <= 0 forks one per cpu
+    :param max_restarts: we give up if workers die more than this many times
+    :param stop_signals: signals that are passed to the workers, after which the
+                         workers that exit are not started again
+    :param reload_signal: starts a new copy of the program with start_successor, handing
+                          it sockets, and stops the workers when it is ready. we keep
+                          restarting the workers that die meanwhile. None to not reload.
+    :param sockets: the listening sockets of the workers, for reload_signal
+    :param workers_report: the workers we fork first call worker_ready() once they
+                           are serving, with sockets of their own, and we tell the process
+                           we replace that we are ready - see notify_ready - after all of
+                           them did. otherwise we tell it as soon as they are forked.
+    :param ready_timeout: seconds the workers have to report, and the new program has to
+                          get ready on reload
+    """
+    def __init__(self, num_processes=None, max_restarts=100,
+                 stop_signals=(signal.SIGTERM, signal.SIGINT), reload_signal=None, sockets=None,
+                 workers_report=False, ready_timeout=60):
+        if num_processes is None or num_processes <= 0:
+            num_processes = cpu_count()
+        self.num_processes = num_processes
+        self.max_restarts = max_restarts
+        self.stop_signals = stop_signals
+        self.reload_signal = reload_signal
+        self.sockets = sockets
+        self.children = {}
+        self.stopping = False
+        self.reloading = False
+        self.num_restarts = 0
+        self.workers_report = workers_report
+        self.ready_timeout = ready_timeout
+        # the pipe the first workers report on
+        self._ready_read = self._ready_write = None
+        # our signal handlers write to it to wake up wait()
+        self._wakeup_read = self._wakeup_write = None
+        # the pipe of the new program on reload and when we give up on it
+        self._successor = None
+        self._previous_handlers = {}
+
+    def start(self):
+        """
+        forks the workers and returns the id of the worker - between 0 and num_processes -
+        in the children. the parent waits for all of them and exits.
+        """
+        logger.info("starting %d processes", self.num_processes)
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        for fd in (self._wakeup_read, self._wakeup_write):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        for signum in self.stop_signals:
+            self._previous_handlers[signum] = signal.signal(signum, self.handle_stop_signal)
+        self._previous_handlers[signal.SIGCHLD] = signal.signal(
+            signal.SIGCHLD, lambda signum, frame: self.wake_up())
+        if self.reload_signal is not None:
+            signal.signal(self.reload_signal, self.handle_reload_signal)
+        if self.workers_report:
+            self._ready_read, self._ready_write = os.pipe()
+        for i in range(self.num_processes):
+            worker_id = self.start_child(i)
+            if worker_id is not None:
+                return worker_id
+        if not self.workers_report:
+            # they accept from the sockets we bound as soon as they are forked
+            notify_ready()
+        elif self.wait_for_workers():
+            notify_ready()
+        else:
+            logger.error("workers didn't report in %s seconds, not telling the process "
+                         "we replace to stop", self.ready_timeout)
+        worker_id = self.wait()
+        if worker_id is not None:
+            return worker_id
+        logger.info("all workers exited")
+        sys.exit(0)
+
+    def start_child(self, i):
+        pid = os.fork()
+        if pid == 0:
+            # we don't want to share the random state of our parent
+            random.seed(int(hexlify(os.urandom(16)), 16))
+            for signum, previous in self._previous_handlers.items():
+                signal.signal(signum, previous)
+            if self.reload_signal is not None:
+                # it is for us, workers stop when we tell them to
+                signal.signal(self.reload_signal, signal.SIG_IGN)
+            # we tell the process we replace when we are ready, not the workers
+            ready_fd = os.environ.pop(READY_FD_ENV, None)
+            if ready_fd is not None:
+                os.close(int(ready_fd))
+            if self._ready_read is not None:
+                os.close(self._ready_read)
+                self._ready_read = None
+            os.close(self._wakeup_read)
+            os.close(self._wakeup_write)
+            self._wakeup_read = self._wakeup_write = None
+            if self._successor is not None:
+                os.close(self._successor[0])
+                self._successor = None
+            return i
+        self.children[pid] = i
+        return None
+
+    def worker_ready(self):
+        "called by a worker once it is serving, if workers_report is set"
+        if self._ready_write is None:
+            # we were restarted, nobody is waiting for us
+            return
+        try:
+            os.write(self._ready_write, b'1')
+        finally:
+            os.close(self._ready_write)
+            self._ready_write = None
+
+    def wait_for_workers(self):
+        """
+        waits until the workers we forked first report, ready_timeout seconds at most.
+        returns False if some of them didn't, they died or are too slow.
+        """
+        read_fd = self._ready_read
+        # the workers hold the write end, it is closed when they are all gone
+        os.close(self._ready_write)
+        self._ready_read = self._ready_write = None
+        deadline = time.time() + self.ready_timeout
+        reported = 0
+        try:
+            while reported < self.num_processes:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    return False
+                try:
+                    readable, _, _ = select.select([read_fd], [], [], timeout)
+                except (OSError, select.error) as e:
+                    if e.args[0] != errno.EINTR:
+                        raise
+                    continue
+                if not readable:
+                    return False
+                data = os.read(read_fd, self.num_processes)
+                if not data:
+                    return False
+                reported += len(data)
+            return True
+        finally:
+            os.close(read_fd)
+
+    def handle_stop_signal(self, signum, frame):
+        logger.info("got signal %d, stopping %d workers", signum, len(self.children))
+        self.stopping = True
+        self.kill_children(signum)
+
+    def handle_reload_signal(self, signum, frame):
+        if self.stopping or self.reloading:
+            return
+        logger.info("got signal %d, reloading", signum)
+        # wait() starts it, we don't block in a signal handler
+        self.reloading = True
+        self.wake_up()
+
+    def wake_up(self):
+        "makes wait() look at the workers and the reload again, safe in a signal handler"
+        try:
+            os.write(self._wakeup_write, b'1')
+        except OSError as e:
+            # it is full, so wait() wakes up anyway
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def start_reload(self):
+        read_fd = start_successor(self.sockets)
+        self._successor = (read_fd, time.time() + self.ready_timeout)
+
+    def successor_started(self, ready):
+        os.close(self._successor[0])
+        self._successor = None
+        self.reloading = False
+        if not ready:
+            logger.error("the new process didn't start, we keep serving")
+            return
+        if self.stopping:
+            return
+        logger.info("the new process is ready, stopping %d workers", len(self.children))
+        self.stopping = True
+        self.kill_children(signal.SIGTERM)
+
+    def sleep(self):
+        """
+        blocks until a signal handler wakes us up - a worker exited too - or the new
+        program is ready or too late
+        """
+        fds = [self._wakeup_read]
+        timeout = None
+        if self._successor is not None:
+            fds.append(self._successor[0])
+            timeout = max(0, self._successor[1] - time.time())
+        try:
+            readable, _, _ = select.select(fds, [], [], timeout)
+        except (OSError, select.error) as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        if self._wakeup_read in readable:
+            os.read(self._wakeup_read, 512)
+        if self._successor is not None:
+            read_fd, deadline = self._successor
+            if read_fd in readable:
+                self.successor_started(os.read(read_fd, 1) == b'1')
+            elif time.time() >= deadline:
+                self.successor_started(False)
+
+    def kill_children(self, signum):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def wait(self):
+        """
+        waits for the workers, starts them again if they die. returns a worker id
+        if we are in a freshly forked child, None when all workers are gone.
+        """
+        while self.children:
+            if self.reloading and self._successor is None and not self.stopping:
+                self.start_reload()
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if pid == 0:
+                self.sleep()
+                continue
+            if pid not in self.children:
+                continue
+            i = self.children.pop(pid)
+            if self.stopping:
+                logger.info("worker %d (pid %d) stopped", i, pid)
+                continue
+            if os.WIFSIGNALED(status):
+                logger.warning("worker %d (pid %d) killed by signal %d, restarting",
+                               i, pid, os.WTERMSIG(status))
+            elif os.WEXITSTATUS(status) != 0:
+                logger.warning("worker %d (pid %d) exited with status %d, restarting",
+                               i, pid, os.WEXITSTATUS(status))
+            else:
+                logger.info("worker %d (pid %d) exited normally", i, pid)
+                continue
+            self.num_restarts += 1
+            if self.num_restarts > self.max_restarts:
+                self.stopping = True
+                self.kill_children(signal.SIGTERM)
+                raise RuntimeError("too many worker restarts, giving up")
+            worker_id = self.start_child(i)
+            if worker_id is not None:
+                return worker_id
+        if self._successor is not None:
+            os.close(self._successor[0])
+            self._successor = None
+        return None
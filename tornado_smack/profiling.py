@@ -0,0 +1,210 @@
+"""
+    smack.profiling
+    ~~~~~~~~~~~~~~~
+
+    profiles single requests you ask for, with a token signed by the app's secret
+    that is good for one path, for an hour by default::
+
+        app = App(profile_secret='s3cret', profile_dir='/tmp/profiles')
+        token = app.profiler.token('/articles/news')
+
+        curl -H "X-Smack-Profile: $token" http://localhost:8888/articles/news -D -
+        curl "http://localhost:8888/articles/news?_profile=$token&_profile_output=html"
+
+    the output is 'header' - the slowest functions in X-Smack-Profile-Stat headers -,
+    'file' - a pstats file per request in profile_dir, named after the route - or
+    'html', a page with the stats instead of the response. requests without a valid
+    token run as usual, they only pay for looking at the header and query argument.
+
+    only one request is profiled at a time, others asking for it meanwhile get
+    X-Smack-Profile: busy. if the view yields, whatever the ioloop runs until it is
+    done shows up in its profile too.
+"""
+
+import os
+import re
+import hmac
+import time
+import pstats
+import hashlib
+import tempfile
+import cProfile
+from tornado import gen
+from tornado.escape import utf8, xhtml_escape
+
+OUTPUTS = ('header', 'file', 'html')
+
+# functions we put in headers or html
+TOP_FUNCTIONS = 20
+
+_html = u"""<!DOCTYPE html>
+<html><head><title>profile of %(route)s</title>
+<style>body{font-family:monospace} td{padding:0 1em;text-align:right} td.fn{text-align:left}</style>
+</head><body>
+<h1>%(method)s %(path)s</h1>
+<p>route %(route)s, %(total).6f seconds</p>
+<table><tr><th>calls</th><th>tottime</th><th>cumtime</th><th>function</th></tr>
+%(rows)s
+</table></body></html>
+"""
+
+
+def _function_name(key):
+    filename, line, name = key
+    return '%s:%d(%s)' % (filename, line, name)
+
+
+def top_functions(profile, limit=TOP_FUNCTIONS):
+    """
+    returns (calls, tottime, cumtime, function) for the functions we spent the most time in
+    """
+    stats = pstats.Stats(profile).stats
+    rows = [(calls, tottime, cumtime, _function_name(key))
+            for key, (primitive, calls, tottime, cumtime, callers) in stats.items()]
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows[:limit]
+
+
+class ProfilingHandlerMixin(object):
+    """
+    holds back finish() while the request is profiled, so we can still add headers
+    or replace the response with the report
+    """
+    _profiling = False
+    _profile_finished = False
+
+    def finish(self, chunk=None):
+        if self._profiling:
+            if chunk is not None:
+                self.write(chunk)
+            self._profile_finished = True
+            return None
+        return super(ProfilingHandlerMixin, self).finish(chunk)
+
+    def get_profile_html(self, route, total, rows):
+        rows = u'\n'.join(
+            u'<tr><td>%d</td><td>%.6f</td><td>%.6f</td><td class="fn">%s</td></tr>' % (
+                calls, tottime, cumtime, xhtml_escape(function))
+            for calls, tottime, cumtime, function in rows)
+        return _html % dict(route=xhtml_escape(route), method=xhtml_escape(self.request.method),
+                            path=xhtml_escape(self.request.path), total=total, rows=rows)
+
+
+class Profiler(object):
+    """
+    :param secret: signs the tokens that turn profiling on
+    :param profile_dir: where 'file' output goes, the temp folder by default
+    :param token_ttl: seconds the tokens we make are valid
+    """
+    header = 'X-Smack-Profile'
+    argument = '_profile'
+
+    def __init__(self, secret, profile_dir=None, token_ttl=3600):
+        self.secret = utf8(secret)
+        self.profile_dir = profile_dir or tempfile.gettempdir()
+        self.token_ttl = token_ttl
+        self.active = False
+
+    def signature(self, path, expires):
+        return hmac.new(self.secret, utf8('%s|%d' % (path, expires)), hashlib.sha256).hexdigest()
+
+    def token(self, path, ttl=None):
+        """
+        the token that profiles requests to path for ttl seconds, token_ttl by default.
+        it carries its expiry time, signed along with the path.
+        """
+        expires = int(time.time() + (self.token_ttl if ttl is None else ttl))
+        return '%d.%s' % (expires, self.signature(path, expires))
+
+    def valid(self, token, path):
+        "is token one of ours for path, and not expired"
+        expires, _, signature = token.partition('.')
+        try:
+            expires = int(expires)
+        except ValueError:
+            return False
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(utf8(signature), utf8(self.signature(path, expires)))
+
+    def requested(self, handler):
+        """
+        returns the output the request asks for, None if it doesn't ask to be
+        profiled or its token isn't valid
+        """
+        request = handler.request
+        token = request.headers.get(self.header)
+        if token is not None:
+            output = request.headers.get(self.header + '-Output', 'header')
+        else:
+            token = handler.get_query_argument(self.argument, None)
+            if token is None:
+                return None
+            output = handler.get_query_argument(self.argument + '_output', 'header')
+        if output not in OUTPUTS:
+            return None
+        if not self.valid(token, request.path):
+            return None
+        return output
+
+    def wrap(self, route, method, view_method=None):
+        """
+        returns a handler method that calls method, or view_method under the profiler
+        if the request asks for it. view_method defaults to method, pass the method
+        without caching so profiled requests skip the cache.
+        """
+        profiler = self
+        if view_method is None:
+            view_method = method
+
+        def profiled(self, *args, **kwargs):
+            output = profiler.requested(self)
+            if output is None:
+                return method(self, *args, **kwargs)
+            return profiler.run(self, route, view_method, args, kwargs, output)
+        return profiled
+
+    @gen.coroutine
+    def run(self, handler, route, method, args, kwargs, output):
+        if self.active:
+            handler.set_header(self.header, 'busy')
+            result = method(handler, *args, **kwargs)
+            if result is not None:
+                yield result
+            return
+        profile = cProfile.Profile()
+        self.active = True
+        handler._profiling = True
+        started = time.time()
+        try:
+            profile.enable()
+            result = method(handler, *args, **kwargs)
+            if result is not None:
+                yield result
+        finally:
+            profile.disable()
+            self.active = False
+            handler._profiling = False
+        total = time.time() - started
+        self.report(handler, route, profile, total, output)
+        if output == 'html' or handler._profile_finished:
+            handler.finish()
+
+    def report(self, handler, route, profile, total, output):
+        if output == 'file':
+            handler.set_header(self.header + '-File', self.dump(route, profile))
+        elif output == 'html':
+            handler.clear()
+            handler.set_header('Content-Type', 'text/html; charset=UTF-8')
+            handler.write(handler.get_profile_html(route, total, top_functions(profile)))
+            return
+        handler.set_header(self.header + '-Time', '%.6f' % total)
+        for calls, tottime, cumtime, function in top_functions(profile):
+            handler.add_header(self.header + '-Stat', '%d %.6f %.6f %s' % (calls, tottime, cumtime, function))
+
+    def dump(self, route, profile):
+        "writes the stats to a file named after the route, returns its path"
+        name = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+        path = os.path.join(self.profile_dir, '%s.%d.prof' % (name, int(time.time() * 1000)))
+        profile.dump_stats(path)
+        return path
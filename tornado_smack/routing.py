@@ -0,0 +1,176 @@
+"""
+    smack.routing
+    ~~~~~~~~~~~~~
+
+    trie based dispatcher for the routes compiled by :class:`tornado_smack.app.App`.
+
+    tornado tries every route regexp in order until one of them matches, so the
+    cost of a lookup grows with the number of routes. here we index werkzeug rules
+    by their path segments, static segments in a dict and dynamic segments by the
+    regexp of their converter, so a lookup only walks as deep as the path is.
+"""
+
+import re
+from tornado.escape import url_unescape
+from tornado.routing import Router
+from werkzeug.routing import PathConverter
+
+# a segment that is a single variable, <name> or <converter(arguments):name>. werkzeug's
+# own parse_rule is gone since 2.2
+_variable_re = re.compile(r'''
+    ^<
+    (?:
+        (?P<converter>[a-zA-Z_][a-zA-Z0-9_]*)   # converter name
+        (?:\((?P<args>.*?)\))?                  # converter arguments
+        \:                                      # variable delimiter
+    )?
+    (?P<variable>[a-zA-Z_][a-zA-Z0-9_]*)        # variable name
+    >$
+''', re.VERBOSE)
+
+
+def _unquote_or_none(s):
+    # same as tornado.routing._unquote_or_none, path args are passed as bytes
+    if s is None:
+        return s
+    return url_unescape(s, encoding=None, plus=False)
+
+
+class _Route(object):
+    __slots__ = ('index', 'regex', 'klass')
+
+    def __init__(self, index, pattern, klass):
+        if not pattern.endswith('$'):
+            pattern += '$'
+        self.index = index
+        self.regex = re.compile(pattern)
+        self.klass = klass
+
+
+class _Node(object):
+    __slots__ = ('static', 'dynamic', 'routes')
+
+    def __init__(self):
+        self.static = {}
+        # [(converter regexp, node)], a list since converters can't be hashed
+        # by what they match, and there are only a few of them per level
+        self.dynamic = []
+        self.routes = []
+
+    def dynamic_child(self, regex):
+        for child_regex, child in self.dynamic:
+            if child_regex.pattern == regex.pattern:
+                return child
+        child = _Node()
+        self.dynamic.append((regex, child))
+        return child
+
+
+def _segment_converter(rule, segment):
+    """
+    returns the converter if segment is a single variable like <int:id>,
+    None if the segment is static, raises ValueError if we can't index it.
+    """
+    if '<' not in segment and '>' not in segment:
+        return None
+    match = _variable_re.match(segment)
+    if match is None:
+        raise ValueError(segment)
+    converter = rule._converters[match.group('variable')]
+    if not getattr(converter, 'part_isolating', not isinstance(converter, PathConverter)):
+        raise ValueError(segment)
+    return re.compile('(?:%s)$' % converter.regex)
+
+
+class TrieRouter(Router):
+    """
+    a tornado router which matches the same routes as the regexp list returned
+    by :meth:`App.get_routes`, in the same order of precedence.
+
+    werkzeug rules are put in a trie, the rest - tornado reg. exp. routes, rules with
+    a trailing slash or a variable in the middle of a segment, path converters - are
+    kept in a list and tried one by one. the trie only finds the candidates, the
+    compiled reg. exp. of the route still has the final word so we never match something
+    tornado wouldn't.
+
+    :param application: the tornado application our handlers will be created for
+    :param routes: list of (pattern, werkzeug rule or None, handler class)
+    """
+    def __init__(self, application, routes):
+        self.application = application
+        self.root = _Node()
+        self.fallback = []
+        self.routes = []
+        for index, (pattern, rule, klass) in enumerate(routes):
+            route = _Route(index, pattern, klass)
+            self.routes.append(route)
+            if rule is None or not self.add_rule(rule, route):
+                self.fallback.append(route)
+
+    def add_rule(self, rule, route):
+        path = rule.rule
+        if not path.startswith('/') or path.endswith('/'):
+            return False
+        node = self.root
+        try:
+            for segment in path[1:].split('/'):
+                regex = _segment_converter(rule, segment)
+                if regex is None:
+                    node = node.static.setdefault(segment, _Node())
+                else:
+                    node = node.dynamic_child(regex)
+        except ValueError:
+            return False
+        node.routes.append(route)
+        return True
+
+    def candidates(self, path):
+        if not path.startswith('/') or '//' in path:
+            # werkzeug merges slashes, we don't index that
+            return self.routes
+        segments = path[1:].split('/')
+        depth = len(segments)
+        found = []
+        stack = [(self.root, 0)]
+        while stack:
+            node, i = stack.pop()
+            if i == depth:
+                found.extend(node.routes)
+                continue
+            segment = segments[i]
+            child = node.static.get(segment)
+            if child is not None:
+                stack.append((child, i + 1))
+            for regex, child in node.dynamic:
+                if regex.match(segment):
+                    stack.append((child, i + 1))
+        if self.fallback:
+            found.extend(self.fallback)
+        if len(found) > 1:
+            found.sort(key=lambda route: route.index)
+        return found
+
+    def match(self, path):
+        """
+        returns (handler class, path_args, path_kwargs) for path, or None
+        """
+        for route in self.candidates(path):
+            match = route.regex.match(path)
+            if match is None:
+                continue
+            path_args, path_kwargs = [], {}
+            if route.regex.groupindex:
+                path_kwargs = dict((str(k), _unquote_or_none(v))
+                                   for (k, v) in match.groupdict().items())
+            else:
+                path_args = [_unquote_or_none(s) for s in match.groups()]
+            return route.klass, path_args, path_kwargs
+        return None
+
+    def find_handler(self, request, **kwargs):
+        match = self.match(request.path)
+        if match is None:
+            return None
+        klass, path_args, path_kwargs = match
+        return self.application.get_handler_delegate(
+            request, klass, path_args=path_args, path_kwargs=path_kwargs)
@@ -0,0 +1,206 @@
+"""
+    smack.server
+    ~~~~~~~~~~~~
+
+    the http server of :meth:`tornado_smack.app.App.run`. it counts the requests
+    in flight, so it can stop gracefully: on SIGTERM or SIGINT we stop accepting
+    connections, let the requests in flight finish - drain_timeout seconds at most -
+    and stop. a second signal stops us right away.
+
+    with reload, SIGHUP starts a fresh copy of the program which takes over our
+    listening sockets, see :func:`tornado_smack.process.start_successor`, and we
+    stop gracefully once it is serving. new code and templates are loaded without
+    refusing a connection or dropping a request.
+"""
+
+import os
+import functools
+import time
+import signal
+import logging
+import weakref
+import tornado.ioloop
+import tornado.httpserver
+from tornado import gen
+from tornado.httputil import HTTPMessageDelegate
+
+logger = logging.getLogger(__name__)
+
+
+class _TrackedRequest(HTTPMessageDelegate):
+    """
+    counts a request from its headers until its response is finished or its
+    connection is closed
+    """
+    def __init__(self, server, delegate, request_conn):
+        self.server = server
+        self.delegate = delegate
+        self.request_conn = request_conn
+        self.counted = False
+
+    def headers_received(self, start_line, headers):
+        self.server.in_flight += 1
+        self.counted = True
+        self.server.fresh.discard(self.request_conn.stream)
+        finish = self.request_conn.finish
+
+        def finished():
+            try:
+                return finish()
+            finally:
+                self.done()
+        self.request_conn.finish = finished
+        return self.delegate.headers_received(start_line, headers)
+
+    def data_received(self, chunk):
+        return self.delegate.data_received(chunk)
+
+    def finish(self):
+        return self.delegate.finish()
+
+    def on_connection_close(self):
+        self.done()
+        return self.delegate.on_connection_close()
+
+    def done(self):
+        if self.counted:
+            self.counted = False
+            self.server.in_flight -= 1
+
+
+class HTTPServer(tornado.httpserver.HTTPServer):
+    """
+    a tornado HTTPServer that knows how many requests it is serving, and can
+    wait for them before stopping
+    """
+    in_flight = 0
+
+    def initialize(self, *args, **kwargs):
+        super(HTTPServer, self).initialize(*args, **kwargs)
+        # streams of the connections we accepted that haven't sent a request yet
+        self.fresh = weakref.WeakSet()
+
+    def handle_stream(self, stream, address):
+        self.fresh.add(stream)
+        super(HTTPServer, self).handle_stream(stream, address)
+
+    def start_request(self, server_conn, request_conn):
+        delegate = super(HTTPServer, self).start_request(server_conn, request_conn)
+        return _TrackedRequest(self, delegate, request_conn)
+
+    @property
+    def pending(self):
+        "requests in flight, and connections we accepted whose first request is on its way"
+        return self.in_flight + sum(1 for stream in self.fresh if not stream.closed())
+
+    @gen.coroutine
+    def drain(self, timeout):
+        """
+        stops accepting connections and waits for the requests in flight, and the
+        first requests of the connections we just accepted, timeout seconds at most.
+        returns True if they all finished.
+        """
+        self.stop()
+        # the responses we still send close their connections
+        self.conn_params.no_keep_alive = True
+        deadline = time.time() + timeout
+        while self.pending and time.time() < deadline:
+            yield gen.sleep(0.05)
+        raise gen.Return(self.pending == 0)
+
+
+class Lifecycle(object):
+    """
+    handles the signals of a serving process
+
+    :param http_server: our :class:`HTTPServer`
+    :param sockets: its listening sockets, handed to the new process on reload
+    :param drain_timeout: seconds we wait for requests in flight when stopping
+    :param stop_signals: stop us gracefully
+    :param reload_signal: starts a new process and stops us when it is ready, None
+                          to not reload
+    :param ready_timeout: seconds the new process has to get ready, we keep serving if
+                          it doesn't
+    :param repeat_window: a stop signal that comes again within this many seconds is
+                          ignored, later ones stop us without waiting. a worker gets
+                          ctrl+c, or systemd's SIGTERM, from both its process group and
+                          the supervisor.
+    """
+    def __init__(self, http_server, sockets=None, drain_timeout=30,
+                 stop_signals=(signal.SIGTERM, signal.SIGINT), reload_signal=None,
+                 ready_timeout=60, repeat_window=1):
+        self.http_server = http_server
+        self.sockets = sockets
+        self.drain_timeout = drain_timeout
+        self.stop_signals = stop_signals
+        self.reload_signal = reload_signal
+        self.ready_timeout = ready_timeout
+        self.repeat_window = repeat_window
+        # the stop signal we got and when
+        self._stop_signal = None
+        self._stopped_at = None
+        self.stopping = False
+        self.reloading = False
+        self.io_loop = None
+
+    def install(self):
+        self.io_loop = tornado.ioloop.IOLoop.current()
+        for signum in self.stop_signals:
+            self._on_signal(signum, functools.partial(self.stop, signum))
+        if self.reload_signal is not None:
+            self._on_signal(self.reload_signal, self.reload)
+
+    def _on_signal(self, signum, callback):
+        asyncio_loop = getattr(self.io_loop, 'asyncio_loop', None)
+        if asyncio_loop is not None:
+            asyncio_loop.add_signal_handler(signum, callback)
+        else:
+            io_loop = self.io_loop
+            signal.signal(signum, lambda signum, frame: io_loop.add_callback_from_signal(callback))
+
+    def stop(self, signum=None):
+        now = time.time()
+        if signum is not None and signum == self._stop_signal and \
+                now - self._stopped_at < self.repeat_window:
+            # the same one again, the supervisor passed on what our process group got
+            return
+        if signum is not None:
+            self._stop_signal = signum
+            self._stopped_at = now
+        if self.stopping:
+            logger.info("stopping without waiting for %d requests", self.http_server.in_flight)
+            self.io_loop.stop()
+            return
+        self.stopping = True
+        logger.info("stopping, waiting for %d requests", self.http_server.in_flight)
+        self.io_loop.add_future(self.http_server.drain(self.drain_timeout), self._drained)
+
+    def _drained(self, future):
+        if not future.result():
+            logger.warning("stopping with %d requests still running after %s seconds",
+                           self.http_server.in_flight, self.drain_timeout)
+        self.io_loop.stop()
+
+    def reload(self):
+        if self.stopping or self.reloading:
+            return
+        from .process import start_successor
+        logger.info("reloading")
+        self.reloading = True
+        read_fd = start_successor(self.sockets)
+        timeout = self.io_loop.call_later(self.ready_timeout, self._successor_started,
+                                          read_fd, False)
+        self.io_loop.add_handler(read_fd, lambda fd, events: self._successor_started(
+            fd, os.read(fd, 1) == b'1', timeout), self.io_loop.READ)
+
+    def _successor_started(self, read_fd, ready, timeout=None):
+        if timeout is not None:
+            self.io_loop.remove_timeout(timeout)
+        self.io_loop.remove_handler(read_fd)
+        os.close(read_fd)
+        self.reloading = False
+        if not ready:
+            logger.error("the new process didn't start, we keep serving")
+            return
+        logger.info("the new process is ready")
+        self.stop()
@@ -0,0 +1,157 @@
+"""
+    smack.static
+    ~~~~~~~~~~~~
+
+    static files for :class:`tornado_smack.app.App`::
+
+        app = App(static_path='static', static_url='/static/')
+
+    on top of tornado.web.StaticFileHandler, which already streams big files in
+    chunks and answers conditional and range requests, we keep small files and
+    their hashes in memory, and serve foo.css.br or foo.css.gz for foo.css to
+    clients that accept them.
+"""
+
+import os
+import hashlib
+import tornado.web
+from .lru import LRUDict
+
+# content encoding -> extension, the ones we like better first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_compressed_extensions = tuple(extension for encoding, extension in ENCODINGS)
+
+
+def _accepted_encodings(accept_encoding):
+    accepted = set()
+    for value in accept_encoding.split(','):
+        parts = value.split(';')
+        if any(part.strip().replace(' ', '') in ('q=0', 'q=0.0') for part in parts[1:]):
+            continue
+        accepted.add(parts[0].strip())
+    return accepted
+
+
+class StaticFileHandler(tornado.web.StaticFileHandler):
+    """
+    use :func:`make_handler_class` to get one with a cache of its own.
+
+    memory_cache: abspath -> content of small files, None to read them from disk
+                  every time
+    max_cached_file_size: bigger files are never kept in memory
+    versions: abspath -> hash of the content, that tornado would compute for
+              every request otherwise. None to do so.
+    variants: abspath -> {extension: abspath} of the compressed files we found
+              when starting, None to look for them on every request
+    """
+    memory_cache = None
+    max_cached_file_size = 0
+    versions = None
+    variants = None
+
+    original_path = None
+
+    @classmethod
+    def _cached(cls, abspath):
+        cache = cls.memory_cache
+        if cache is None:
+            return None
+        content = cache.get(abspath)
+        if content is None:
+            if os.path.getsize(abspath) > cls.max_cached_file_size:
+                return None
+            content = b''.join(super(StaticFileHandler, cls).get_content(abspath))
+            cache[abspath] = content
+        return content
+
+    @classmethod
+    def get_content(cls, abspath, start=None, end=None):
+        content = cls._cached(abspath)
+        if content is None:
+            return super(StaticFileHandler, cls).get_content(abspath, start, end)
+        return content[start:end]
+
+    @classmethod
+    def get_content_version(cls, abspath):
+        versions = cls.versions
+        if versions is None:
+            return super(StaticFileHandler, cls).get_content_version(abspath)
+        version = versions.get(abspath)
+        if version is None:
+            content = cls._cached(abspath)
+            if content is None:
+                version = super(StaticFileHandler, cls).get_content_version(abspath)
+            else:
+                # same as tornado
+                version = hashlib.md5(content).hexdigest()
+            versions[abspath] = version
+        return version
+
+    def find_variant(self, absolute_path, extension):
+        "returns the path of the compressed file with extension, None if there is none"
+        if self.variants is not None:
+            return self.variants.get(absolute_path, {}).get(extension)
+        if os.path.isfile(absolute_path + extension):
+            return absolute_path + extension
+        return None
+
+    def validate_absolute_path(self, root, absolute_path):
+        absolute_path = super(StaticFileHandler, self).validate_absolute_path(root, absolute_path)
+        self.original_path = absolute_path
+        if absolute_path is None or absolute_path.endswith(_compressed_extensions):
+            return absolute_path
+        accepted = None
+        for encoding, extension in ENCODINGS:
+            variant = self.find_variant(absolute_path, extension)
+            if variant is None:
+                continue
+            self.set_header('Vary', 'Accept-Encoding')
+            if accepted is None:
+                accepted = _accepted_encodings(self.request.headers.get('Accept-Encoding', ''))
+            if encoding in accepted:
+                self.set_header('Content-Encoding', encoding)
+                # so tornado looks at the variant from now on
+                return super(StaticFileHandler, self).validate_absolute_path(root, variant)
+        return absolute_path
+
+    def get_content_type(self):
+        # the type of foo.css, not foo.css.gz
+        absolute_path = self.absolute_path
+        self.absolute_path = self.original_path
+        try:
+            return super(StaticFileHandler, self).get_content_type()
+        finally:
+            self.absolute_path = absolute_path
+
+
+def list_files(static_path):
+    "paths of the files in static_path, relative to it"
+    for dirpath, dirnames, filenames in os.walk(static_path):
+        for filename in filenames:
+            yield os.path.relpath(os.path.join(dirpath, filename), static_path)
+
+
+def make_handler_class(static_path, cache_bytes=16 * 1024 * 1024, cache_file_size=256 * 1024,
+                       production=True):
+    """
+    returns a StaticFileHandler with its own memory cache. in production mode we find
+    the compressed variants of files and hash all of them - for versioned static urls -
+    right away, otherwise files are looked at on every request, so you can change them.
+    """
+    klass = type('StaticFileHandler', (StaticFileHandler,), {})
+    if not production:
+        return klass
+    klass.memory_cache = LRUDict(max_bytes=cache_bytes, sizeof=len)
+    klass.max_cached_file_size = cache_file_size
+    klass.versions = {}
+    klass.variants = {}
+    settings = dict(static_path=static_path)
+    for path in list_files(static_path):
+        absolute_path = klass.get_absolute_path(static_path, path)
+        if absolute_path.endswith(_compressed_extensions):
+            original, extension = os.path.splitext(absolute_path)
+            if os.path.isfile(original):
+                klass.variants.setdefault(original, {})[extension] = absolute_path
+        klass.get_version(settings, path)
+    return klass
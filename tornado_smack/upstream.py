@@ -0,0 +1,158 @@
+"""
+    smack.upstream
+    ~~~~~~~~~~~~~~
+
+    one http client for all the requests your views send to other services::
+
+        @app.route("/dashboard/<id>")
+        async def dashboard(id):
+            user, orders = await gen.multi([
+                handler.upstream.fetch("http://users/%s" % id),
+                handler.upstream.fetch("http://orders/?user=%s" % id)])
+            ...
+
+    at most max_per_host requests go to one host at once, the others wait for
+    their turn up to queue_timeout seconds, after which they fail with a 599
+    HTTPError, like tornado's own timeouts. the client is shared, so connections
+    are kept alive and reused when pycurl is installed - tornado's simple client
+    opens one per request.
+"""
+
+from datetime import timedelta
+import tornado.ioloop
+from tornado import gen, locks
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPError
+from .metrics import Histogram, histogram_lines, escape_label, timer
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    # python 2
+    from urlparse import urlsplit
+
+try:
+    import pycurl
+except ImportError:
+    pycurl = None
+
+
+class HostStats(object):
+    """
+    requests to one host, and the semaphore that limits them
+    """
+    def __init__(self, host, max_per_host):
+        self.host = host
+        self.semaphore = locks.Semaphore(max_per_host)
+        self.in_flight = 0
+        self.queued = 0
+        self.requests = 0
+        self.errors = 0
+        self.queue_timeouts = 0
+        self.latency = Histogram()
+
+    def stats(self):
+        return dict(in_flight=self.in_flight, queued=self.queued, requests=self.requests,
+                    errors=self.errors, queue_timeouts=self.queue_timeouts)
+
+
+class UpstreamClient(object):
+    """
+    :param max_clients: requests in flight at once, to all hosts
+    :param max_per_host: requests in flight at once to one host
+    :param queue_timeout: seconds a request waits for its turn, None to wait forever
+    :param client_class: an AsyncHTTPClient implementation, by default curl's if we have
+                         pycurl, for keep-alive connections, tornado's simple one otherwise.
+    :param defaults: default arguments for every HTTPRequest, like request_timeout
+    """
+    def __init__(self, max_clients=100, max_per_host=10, queue_timeout=5, client_class=None,
+                 defaults=None):
+        if client_class is None and pycurl is not None:
+            client_class = 'tornado.curl_httpclient.CurlAsyncHTTPClient'
+        self.max_clients = max_clients
+        self.max_per_host = max_per_host
+        self.queue_timeout = queue_timeout
+        self.client_class = client_class
+        self.defaults = defaults
+        self.hosts = {}
+        self._client = None
+        self._io_loop = None
+
+    @property
+    def client(self):
+        "the AsyncHTTPClient of the current ioloop"
+        io_loop = tornado.ioloop.IOLoop.current()
+        if self._client is None or self._io_loop is not io_loop:
+            kwargs = dict(force_instance=True, max_clients=self.max_clients, defaults=self.defaults)
+            if self.client_class is None:
+                self._client = AsyncHTTPClient(**kwargs)
+            else:
+                from tornado.util import import_object
+                client_class = self.client_class
+                if not isinstance(client_class, type):
+                    client_class = import_object(client_class)
+                self._client = client_class(**kwargs)
+            self._io_loop = io_loop
+            # semaphores of another ioloop are of no use either
+            self.hosts = {}
+        return self._client
+
+    def host(self, host):
+        stats = self.hosts.get(host)
+        if stats is None:
+            stats = self.hosts[host] = HostStats(host, self.max_per_host)
+        return stats
+
+    @gen.coroutine
+    def fetch(self, request, **kwargs):
+        """
+        like AsyncHTTPClient.fetch, waits for a free slot for the host first
+        """
+        client = self.client
+        url = request.url if isinstance(request, HTTPRequest) else request
+        host = self.host(urlsplit(url).netloc)
+        host.queued += 1
+        try:
+            if self.queue_timeout is None:
+                yield host.semaphore.acquire()
+            else:
+                yield host.semaphore.acquire(timedelta(seconds=self.queue_timeout))
+        except gen.TimeoutError:
+            host.queue_timeouts += 1
+            raise HTTPError(599, 'Timeout waiting for a connection to %s' % host.host)
+        finally:
+            host.queued -= 1
+        host.in_flight += 1
+        host.requests += 1
+        started = timer()
+        try:
+            response = yield client.fetch(request, **kwargs)
+        except Exception:
+            host.errors += 1
+            raise
+        finally:
+            host.latency.observe(timer() - started)
+            host.in_flight -= 1
+            host.semaphore.release()
+        raise gen.Return(response)
+
+    def stats(self):
+        "host -> counters of its requests"
+        return dict((host, stats.stats()) for host, stats in self.hosts.items())
+
+    def render(self):
+        "our stats in the prometheus text format, as lines"
+        lines = []
+        hosts = sorted(self.hosts.items())
+        for name, kind in (('in_flight', 'gauge'), ('queued', 'gauge'), ('requests', 'counter'),
+                           ('errors', 'counter'), ('queue_timeouts', 'counter')):
+            metric = 'smack_upstream_%s' % name
+            if kind == 'counter':
+                metric += '_total'
+            lines.append('# TYPE %s %s' % (metric, kind))
+            for host, stats in hosts:
+                lines.append('%s{host="%s"} %d' % (metric, escape_label(host), getattr(stats, name)))
+        lines.append('# TYPE smack_upstream_duration_seconds histogram')
+        for host, stats in hosts:
+            lines.extend(histogram_lines('smack_upstream_duration_seconds',
+                                         'host="%s"' % escape_label(host), stats.latency))
+        return lines